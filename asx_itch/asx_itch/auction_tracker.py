@@ -0,0 +1,137 @@
+import argparse
+import numpy as np
+import data_messages as dm
+from columnar import DTYPES
+
+Z = dm.AuctionEquilibriumPriceUpdateMsg
+FIELDS = Z.FIELDS[2:]
+SERIES_DTYPE = np.dtype([('Timestamp', np.int64)] + [
+    (f, DTYPES[Z.MT][f].newbyteorder('=')) for f in FIELDS])
+
+
+class AuctionTracker:
+    '''
+        AuctionEquilibriumPriceUpdate (Z) conflation: of the updates of a
+        book within each interval (ns) only the last one is kept, as a
+        SERIES_DTYPE row. Updates are conflated with numpy, a columnar
+        table at a time or buffer_size message dicts at a time; the last
+        update of each book stays pending until a later interval shows up
+        (or flush()).
+    '''
+    def __init__(self, interval=dm.NS, buffer_size=4096):
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.pending = np.zeros(0, dtype=SERIES_DTYPE)
+        self.chunks = []
+        self.updates = 0
+
+    def update(self, d):
+        '''
+            one message dict stamped by data_messages.Clock; not Z ignored
+        '''
+        if d.get('Message Type') == Z.MT:
+            self.buffer.append(
+                (d['Timestamp'],) + tuple(d[f] for f in FIELDS))
+            if len(self.buffer) >= self.buffer_size:
+                self._flush_buffer()
+
+    def update_table(self, table, stamps):
+        '''
+            a columnar Z table and its absolute times (Batch.timestamps)
+        '''
+        rows = np.zeros(len(table), dtype=SERIES_DTYPE)
+        rows['Timestamp'] = stamps
+        for f in FIELDS:
+            rows[f] = table[f]
+        self._conflate(rows)
+
+    def _flush_buffer(self):
+        if self.buffer:
+            rows = np.array(self.buffer, dtype=SERIES_DTYPE)
+            self.buffer = []
+            self._conflate(rows)
+
+    def _conflate(self, rows):
+        self.updates += len(rows)
+        rows = np.concatenate([self.pending, rows])
+        bucket = rows['Timestamp'] // self.interval
+        # by book, then interval, then arrival
+        order = np.lexsort((np.arange(len(rows)), bucket,
+                            rows['Order Book ID']))
+        rows = rows[order]
+        bucket = bucket[order]
+        book = rows['Order Book ID']
+        book_last = np.ones(len(rows), dtype=bool)
+        book_last[:-1] = book[1:] != book[:-1]
+        last = book_last.copy()
+        last[:-1] |= bucket[1:] != bucket[:-1]
+        self.chunks.append(rows[last & ~book_last])
+        self.pending = rows[book_last]
+
+    def latest(self):
+        '''
+            the last update of every book (SERIES_DTYPE), by Order Book ID
+        '''
+        self._flush_buffer()
+        return self.pending
+
+    def flush(self):
+        '''
+            the conflated series (SERIES_DTYPE) of all books, by Order Book
+            ID then time; pending updates included
+        '''
+        self._flush_buffer()
+        series = np.concatenate(self.chunks + [self.pending])
+        self.chunks = [series[np.argsort(series['Order Book ID'],
+                                         kind='stable')]]
+        self.pending = np.zeros(0, dtype=SERIES_DTYPE)
+        return self.chunks[0]
+
+    def export(self, path):
+        '''
+            one compressed array per book in an .npz, keyed by Order Book ID
+        '''
+        series = self.flush()
+        books, starts = np.unique(series['Order Book ID'], return_index=True)
+        np.savez_compressed(path, **{
+            str(book): part for book, part in zip(
+                books.tolist(), np.split(series, starts[1:]))})
+        return books
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./tcp_partition4.pcap')
+    parser.add_argument('--proto', choices=('tcp', 'udp'), default='tcp')
+    parser.add_argument('--src-ip', default='203.0.119.230')
+    parser.add_argument('--src-port', type=int, default=21804)
+    parser.add_argument('--dst-ip', default='10.31.38.4')
+    parser.add_argument('--dst-port', type=int, default=45793)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='decode processes for a tcp capture')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='conflation interval in seconds')
+    parser.add_argument('--out', default='./auction_series.npz')
+    args = parser.parse_args()
+
+    tracker = AuctionTracker(int(args.interval * dm.NS))
+    if args.proto == 'tcp':
+        import pcap_parallel
+        second = 0
+        for batch in pcap_parallel.iter_batches(
+                args.pcap_file, (args.dst_ip, args.dst_port),
+                (args.src_ip, args.src_port), args.workers):
+            stamps, second = batch.timestamps(second)
+            if Z.MT in batch.tables:
+                tracker.update_table(batch.tables[Z.MT], stamps[Z.MT])
+    else:
+        import pcap_mold_extract
+        for _, _, d in pcap_mold_extract.iter_msgs(args.pcap_file):
+            tracker.update(d)
+    for row in tracker.latest():
+        print({f: row[f].item() for f in SERIES_DTYPE.names})
+    books = tracker.export(args.out)
+    print(f'{tracker.updates} updates conflated to '
+          f'{len(tracker.chunks[0])} points for {len(books)} books '
+          f'in {args.out}')
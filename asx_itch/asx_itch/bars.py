@@ -0,0 +1,142 @@
+import argparse
+import numpy as np
+import data_messages as dm
+import partition_merge
+from order_book import OrderBook
+
+BAR_DTYPE = np.dtype([
+    ('book', np.uint32),
+    ('start', np.int64),        # bucket start, epoch ns
+    ('open', np.int32),
+    ('high', np.int32),
+    ('low', np.int32),
+    ('close', np.int32),
+    ('volume', np.uint64),
+    ('notional', np.float64),   # sum of price * quantity
+    ('trades', np.uint32)])
+
+
+def vwap(bars):
+    return bars['notional'] / np.maximum(bars['volume'], 1)
+
+
+class BarBuilder:
+    '''
+        streaming OHLCV bars of interval ns per Order Book ID from the
+        trades (P) and executions (E, C) as they are decoded; executions
+        without a price (E) take the one of the resting order, kept in an
+        OrderBook fed with the order messages. Only the open bar of each
+        book is held (one numpy row per book); closed bars queue up until
+        drain() is called.
+    '''
+    def __init__(self, interval=60 * dm.NS, book=None, capacity=1024):
+        self.interval = interval
+        self.book = OrderBook() if book is None else book
+        self.bars = np.zeros(capacity, dtype=BAR_DTYPE)
+        self.rows = {}
+        self.closed = []
+
+    def apply(self, d):
+        '''
+            update from one message dict stamped by data_messages.Clock
+        '''
+        mt = d.get('Message Type')
+        if mt == b'P':
+            if d['Printable'] == b'Y':
+                self.trade(d['Order Book ID'], d['Timestamp'],
+                           d['Trade Price'], d['Quantity'])
+        elif mt == b'E':
+            price = self.book.execute(d['Order Book ID'], d['Side'],
+                                      d['Order ID'], d['Executed Quantity'])
+            if price is not None:
+                self.trade(d['Order Book ID'], d['Timestamp'], price,
+                           d['Executed Quantity'])
+        elif mt == b'C':
+            self.book.execute(d['Order Book ID'], d['Side'], d['Order ID'],
+                              d['Executed Quantity'])
+            if d['Printable'] == b'Y':
+                self.trade(d['Order Book ID'], d['Timestamp'],
+                           d['Trade Price'], d['Executed Quantity'])
+        else:
+            self.book.apply(d)
+
+    def _row(self, book):
+        row = self.rows.get(book)
+        if row is None:
+            row = self.rows[book] = len(self.rows)
+            if row == len(self.bars):
+                self.bars = np.concatenate(
+                    [self.bars, np.zeros(len(self.bars), dtype=BAR_DTYPE)])
+        return row
+
+    def trade(self, book, ts, price, quantity):
+        start = ts - ts % self.interval
+        bar = self.bars[self._row(book)]
+        if bar['trades'] and bar['start'] != start:
+            self.closed.append(bar.copy())
+            bar['trades'] = 0
+        if not bar['trades']:
+            bar['book'] = book
+            bar['start'] = start
+            bar['open'] = bar['high'] = bar['low'] = price
+            bar['volume'] = 0
+            bar['notional'] = 0
+        bar['high'] = max(bar['high'], price)
+        bar['low'] = min(bar['low'], price)
+        bar['close'] = price
+        bar['volume'] += quantity
+        bar['notional'] += price * quantity
+        bar['trades'] += 1
+
+    def drain(self):
+        '''
+            the bars closed so far (BAR_DTYPE), oldest first
+        '''
+        closed = np.array(self.closed, dtype=BAR_DTYPE)
+        self.closed = []
+        return closed
+
+    def flush(self):
+        '''
+            close the open bars too, e.g. at the end of the stream
+        '''
+        open_bars = self.bars[:len(self.rows)]
+        self.closed.extend(open_bars[open_bars['trades'] > 0])
+        open_bars['trades'] = 0
+        return self.drain()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./udp_partition4.pcap')
+    parser.add_argument('--proto', choices=('tcp', 'udp'), default='udp')
+    parser.add_argument('--interval', type=float, default=60,
+                        help='bar length in seconds')
+    parser.add_argument('--refdata', default=None,
+                        help='refdata file, to print prices with decimals')
+    args = parser.parse_args()
+
+    stream = partition_merge.soup_stream(args.pcap_file) \
+        if args.proto == 'tcp' else \
+        partition_merge.mold_stream(args.pcap_file)
+    builder = BarBuilder(int(args.interval * dm.NS))
+    scale = None
+    if args.refdata:
+        import refdata
+        scale = refdata.RefData.load(args.refdata).scale
+
+    def report(bars):
+        prices = {f: bars[f] for f in ('open', 'high', 'low', 'close')}
+        prices['vwap'] = vwap(bars)
+        if scale is not None:
+            prices = {f: scale(bars['book'], p) for f, p in prices.items()}
+        for i, bar in enumerate(bars):
+            print(f"{bar['book']} {bar['start'] // dm.NS} " +
+                  ' '.join(f'{f} {p[i]:g}' for f, p in prices.items()) +
+                  f" volume {bar['volume']} trades {bar['trades']}")
+
+    for _, d in stream:
+        builder.apply(d)
+        if builder.closed:
+            report(builder.drain())
+    report(builder.flush())
@@ -0,0 +1,209 @@
+import argparse
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+import pcap_index
+import pcap_reader
+import itch_MoldUDP64
+from order_book import OrderBook
+
+
+def checkpoint_path(directory, session, seq):
+    return os.path.join(
+        directory, f'{session.decode().strip()}-{seq:020d}')
+
+
+def write(directory, orders, session, seq, states):
+    '''
+        <path>.npy: the live orders (order_book.ORDER_DTYPE, memory
+        mappable); <path>.json: session, sequence number and book states
+    '''
+    path = checkpoint_path(directory, session, seq)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    np.save(tmp + '.npy', orders)
+    with open(tmp + '.json', 'w') as f:
+        json.dump({'session': session.decode(), 'seq': seq,
+                   'orders': len(orders),
+                   'states': {str(book): state.decode()
+                              for book, state in states.items()}}, f)
+    # json last: its presence marks a complete checkpoint
+    for ext in ('.npy', '.json'):
+        os.replace(tmp + ext, path + ext)
+    return path
+
+
+def list_checkpoints(directory):
+    '''
+        [(seq, path)] of the complete checkpoints, oldest first
+    '''
+    paths = [p[:-len('.json')]
+             for p in glob.glob(os.path.join(directory, '*-*.json'))]
+    return sorted((int(p.rsplit('-', 1)[1]), p) for p in paths
+                  if p.rsplit('-', 1)[1].isdigit())
+
+
+def load(path, mmap=True):
+    '''
+        return (OrderBook, session, sequence number of the last message in it)
+    '''
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    orders = np.load(path + '.npy', mmap_mode='r' if mmap else None)
+    states = {int(book): state.encode()
+              for book, state in meta['states'].items()}
+    return (OrderBook.from_orders(orders, states), meta['session'].encode(),
+            meta['seq'])
+
+
+class Checkpointer:
+    '''
+        checkpoint an OrderBook every `every` messages: the live orders are
+        copied in the caller's thread (the only pause) and written by a
+        background thread; a checkpoint falling due while the previous one
+        is still being written waits for the next message. The last `keep`
+        checkpoints are kept. A failed write is reported and the thread
+        goes on with the next one; close() raises the first failure.
+    '''
+    def __init__(self, directory, every=1000000, keep=2):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every = every
+        self.keep = keep
+        self.since = 0
+        self.written = []
+        self.errors = []
+        self.pending = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def update(self, book, session, seq, messages=1):
+        '''
+            call after applying messages, seq being the last one
+        '''
+        self.since += messages
+        if self.since >= self.every:
+            self.checkpoint(book, session, seq)
+
+    def checkpoint(self, book, session, seq):
+        try:
+            self.pending.put_nowait(
+                (book.orders(), session, seq, dict(book.states)))
+            self.since = 0
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            orders, session, seq, states = item
+            try:
+                self.written.append(
+                    (seq, write(self.directory, orders, session, seq,
+                                states)))
+                for _, path in list_checkpoints(self.directory)[:-self.keep]:
+                    for ext in ('.json', '.npy'):
+                        os.remove(path + ext)
+            except Exception as e:
+                self.errors.append(e)
+                print(f'checkpoint at seq {seq} failed: {e!r}',
+                      file=sys.stderr)
+
+    def close(self):
+        '''
+            wait for the checkpoint being written, if any; raise the first
+            write failure
+        '''
+        self.pending.put(None)
+        self.thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+
+def journal_session(pcap_file):
+    '''
+        session of the first MoldUDP64 packet of a journal, None if empty
+    '''
+    for _, _, payload in pcap_reader.iter_payloads(
+            pcap_file, pcap_reader.IP_PROTO_UDP):
+        if len(payload) >= itch_MoldUDP64.Header.STRUCT.size:
+            return itch_MoldUDP64.decode_header(payload)[0]
+    return None
+
+
+def replay(book, pcap_file, seq=0, checkpointer=None, session=b''):
+    '''
+        apply the MoldUDP64 messages of session after seq in a capture of
+        the feed (the journal), seeking with its pcap_index; the messages
+        of other sessions are left out
+        return the sequence number of the last message applied
+    '''
+    index = pcap_index.load(pcap_file, 'udp')
+    if not len(index):
+        return seq
+    for _, msg_seq, _, d in pcap_index.iter_window(
+            pcap_file, index, 'udp', seq=seq + 1, session=session or None):
+        if msg_seq <= seq:
+            continue
+        seq = msg_seq
+        book.apply(d)
+        if checkpointer is not None:
+            checkpointer.update(book, session, seq)
+    return seq
+
+
+def restore(directory, pcap_file):
+    '''
+        the latest checkpoint, brought up to date with the journal tail
+        return (OrderBook, session, sequence number)
+    '''
+    checkpoints = list_checkpoints(directory)
+    journal = journal_session(pcap_file)
+    if checkpoints:
+        book, session, seq = load(checkpoints[-1][1])
+        if journal is not None and session != journal:
+            raise ValueError(f'checkpoint of session {session}, journal of '
+                             f'session {journal}')
+    else:
+        book, session, seq = OrderBook(), journal or b'', 0
+    return book, session, replay(book, pcap_file, seq, session=session)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./udp_partition4.pcap',
+                        help='capture of the MoldUDP64 feed (the journal)')
+    parser.add_argument('--checkpoint-dir', default='./checkpoints')
+    parser.add_argument('--every', type=int, default=1000000,
+                        help='messages between checkpoints')
+    parser.add_argument('--keep', type=int, default=2)
+    parser.add_argument('--session', default=None,
+                        help='session to checkpoint, that of the journal '
+                        'if unspecified')
+    parser.add_argument('--restore', action='store_true',
+                        help='load the latest checkpoint and replay the '
+                        'journal tail instead of checkpointing a replay '
+                        'from the start')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.restore:
+        book, session, seq = restore(args.checkpoint_dir, args.pcap_file)
+    else:
+        book = OrderBook()
+        session = journal_session(args.pcap_file) or b'' \
+            if args.session is None else args.session.encode()
+        checkpointer = Checkpointer(args.checkpoint_dir, args.every,
+                                    args.keep)
+        seq = replay(book, args.pcap_file, 0, checkpointer, session)
+        checkpointer.close()
+        for written_seq, path in checkpointer.written:
+            print(f'checkpoint at seq {written_seq}: {path}')
+    print(f'book at seq {seq} of session {session}: {len(book)} orders, '
+          f'{time.perf_counter() - t0:.3f}s')
@@ -0,0 +1,268 @@
+import argparse
+import time
+import numpy as np
+import pcap_index
+import pcap_reader
+import data_messages as dm
+from partition_merge import parse_addr
+from pcap_query import BOOK_OFFSET, be, iter_mold_chunks, iter_soup_chunks
+
+PEAK_DTYPE = np.dtype([('start', np.float64), ('count', np.int64)])
+
+
+def add_hist(hist, values):
+    '''
+        hist (counts by value) with the values counted in, grown as needed
+    '''
+    counts = np.bincount(values)
+    if len(counts) > len(hist):
+        hist = np.concatenate([hist, np.zeros(len(counts) - len(hist),
+                                              dtype=np.int64)])
+    hist[:len(counts)] += counts
+    return hist
+
+
+def percentile(hist, q):
+    '''
+        the value below which q percent of a histogram's counts fall
+    '''
+    total = hist.sum()
+    if not total:
+        return 0
+    return int(np.searchsorted(np.cumsum(hist), total * q / 100.0))
+
+
+class Rate:
+    '''
+        message counts per bucket of width seconds of capture time: the
+        histogram of the counts of all the buckets spanned (empty ones
+        included) and the top busiest buckets. The last bucket stays open
+        until a later one shows up (or finish()).
+    '''
+    def __init__(self, width, top=10):
+        self.width = width
+        self.top = top
+        self.hist = np.zeros(1, dtype=np.int64)
+        self.peaks = np.zeros(0, dtype=PEAK_DTYPE)
+        self.open = None
+        self.first = None
+        self.last = None
+        self.filled = 0
+
+    def update(self, capture_ts):
+        if not len(capture_ts):
+            return
+        ids, counts = np.unique(np.floor(capture_ts / self.width).astype(
+            np.int64), return_counts=True)
+        if self.open is not None:
+            open_id, open_count = self.open
+            if ids[0] == open_id:
+                counts[0] += open_count
+            else:
+                self._close(np.array([open_id]), np.array([open_count]))
+        self.open = ids[-1], counts[-1]
+        self._close(ids[:-1], counts[:-1])
+
+    def _close(self, ids, counts):
+        if not len(ids):
+            return
+        self.first = ids[0] if self.first is None else min(self.first, ids[0])
+        self.last = ids[-1] if self.last is None else max(self.last, ids[-1])
+        self.filled += len(ids)
+        self.hist = add_hist(self.hist, counts)
+        new = np.zeros(len(ids), dtype=PEAK_DTYPE)
+        new['start'] = ids * self.width
+        new['count'] = counts
+        peaks = np.concatenate([self.peaks, new])
+        self.peaks = peaks[np.argsort(-peaks['count'], kind='stable')
+                           [:self.top]]
+
+    def finish(self):
+        if self.open is not None:
+            open_id, open_count = self.open
+            self.open = None
+            self._close(np.array([open_id]), np.array([open_count]))
+        # buckets without a message between the first and the last
+        if self.first is not None:
+            self.hist[0] = self.last - self.first + 1 - self.filled
+
+    def rate(self, count):
+        return count / self.width
+
+
+class CaptureStats:
+    '''
+        one streaming pass of counters over the raw messages of a partition
+        (pcap_query.Chunk at a time, with numpy, no message dicts): counts
+        by message type, message and packet payload size histograms,
+        message rates at 1 ms and 1 s of capture time with their peaks,
+        counts by Order Book ID and sequence gaps per session (MoldUDP64
+        only, the SoupBinTCP sequence numbers being implicit)
+    '''
+    def __init__(self, top=10):
+        self.top = top
+        self.types = np.zeros(256, dtype=np.int64)
+        self.msg_sizes = np.zeros(1, dtype=np.int64)
+        self.packet_sizes = np.zeros(1, dtype=np.int64)
+        self.rates = [Rate(0.001, top), Rate(1.0, top)]
+        self.book_ids = np.zeros(0, dtype=np.int64)
+        self.book_counts = np.zeros(0, dtype=np.int64)
+        self.next_seq = {}
+        self.gaps = []
+        self.duplicates = 0
+        self.bytes = 0
+        self.span = None
+
+    def __len__(self):
+        return int(self.types.sum())
+
+    def update(self, chunk, packet_sizes=()):
+        self.types += np.bincount(chunk.types, minlength=256)
+        self.msg_sizes = add_hist(self.msg_sizes, chunk.sizes)
+        self.packet_sizes = add_hist(self.packet_sizes,
+                                     np.asarray(packet_sizes, dtype=np.int64))
+        self.bytes += int(np.sum(packet_sizes))
+        for rate in self.rates:
+            rate.update(chunk.capture_ts)
+        if len(chunk):
+            first, last = chunk.capture_ts[0], chunk.capture_ts[-1]
+            self.span = (first, last) if self.span is None else (
+                self.span[0], last)
+        self._update_books(chunk)
+        self._update_seqs(chunk.seqs, chunk.sessions)
+
+    def _update_books(self, chunk):
+        book_offset = BOOK_OFFSET[chunk.types]
+        has_book = (book_offset >= 0) & (chunk.sizes >= book_offset + 4)
+        books, counts = np.unique(
+            be(chunk.buf, chunk.offsets[has_book] + book_offset[has_book]),
+            return_counts=True)
+        ids, inverse = np.unique(np.concatenate([self.book_ids, books]),
+                                 return_inverse=True)
+        self.book_counts = np.bincount(
+            inverse.reshape(-1), np.concatenate([self.book_counts, counts]),
+            minlength=len(ids)).astype(np.int64)
+        self.book_ids = ids
+
+    def _update_seqs(self, seqs, sessions=None):
+        if sessions is None:
+            self._update_session_seqs(None, seqs)
+            return
+        for session in np.unique(sessions).tolist():
+            self._update_session_seqs(session, seqs[sessions == session])
+
+    def _update_session_seqs(self, session, seqs):
+        if not len(seqs):
+            return
+        next_seq = self.next_seq.get(session, int(seqs[0]))
+        # the highest sequence number seen before each message
+        high = np.maximum.accumulate(
+            np.concatenate([[next_seq - 1], seqs]))[:-1]
+        gap = np.flatnonzero(seqs > high + 1)
+        self.gaps.extend((session, first, last) for first, last in zip(
+            (high[gap] + 1).tolist(), (seqs[gap] - 1).tolist()))
+        self.duplicates += int(np.count_nonzero(seqs <= high))
+        self.next_seq[session] = max(int(high[-1]), int(seqs[-1])) + 1
+
+    def finish(self):
+        for rate in self.rates:
+            rate.finish()
+
+    def busiest(self):
+        '''
+            (Order Book ID, message count) of the top busiest books
+        '''
+        order = np.argsort(-self.book_counts, kind='stable')[:self.top]
+        return list(zip(self.book_ids[order].tolist(),
+                        self.book_counts[order].tolist()))
+
+    def report(self, name=''):
+        elapsed = self.span[1] - self.span[0] if self.span else 0
+        print(f'{name}: {len(self)} messages, {self.bytes} payload bytes '
+              f'in {int(self.packet_sizes.sum())} packets over '
+              f'{elapsed:.3f}s of capture')
+        for code in np.flatnonzero(self.types).tolist():
+            msg_cls = dm.MSG_TYPE_STRUCT_MAP.get(bytes([code]))
+            label = msg_cls.__name__ if msg_cls else 'unknown'
+            print(f'    {bytes([code])} {label}: {self.types[code]}')
+        for rate in self.rates:
+            unit = f'{rate.width * 1000:g}ms' if rate.width < 1 else \
+                f'{rate.width:g}s'
+            print(f'    msgs/s at {unit}: ' + ', '.join(
+                f'p{q} {rate.rate(percentile(rate.hist, q)):.0f}'
+                for q in (50, 90, 99, 99.9, 100)))
+            for start, count in rate.peaks.tolist():
+                print(f'        peak {start:.6f}: {count} msgs '
+                      f'({rate.rate(count):.0f} msgs/s)')
+        for label, hist in (('message', self.msg_sizes),
+                            ('packet payload', self.packet_sizes)):
+            sizes = np.flatnonzero(hist)
+            if len(sizes):
+                print(f'    {label} sizes {sizes[0]}-{sizes[-1]}: ' +
+                      ', '.join(f'p{q} {percentile(hist, q)}'
+                                for q in (50, 90, 99)))
+        print('    busiest books: ' + ', '.join(
+            f'{book} ({count})' for book, count in self.busiest()))
+        missing = sum(last - first + 1 for _, first, last in self.gaps)
+        print(f'    {len(self.gaps)} sequence gaps ({missing} messages '
+              f'missing), {self.duplicates} repeated')
+        for session, first, last in self.gaps[:self.top]:
+            where = '' if session is None else f'session {session}: '
+            print(f'        {where}gap {first}-{last}')
+
+
+def _sized(payloads, sizes):
+    for rec in payloads:
+        sizes.append(len(rec[2]))
+        yield rec
+
+
+def collect(pcap_file, proto='tcp', src_addr=None, dst_addr=None, top=10,
+            chunk_size=1 << 22):
+    '''
+        CaptureStats of one partition (a capture or a multicast_recv
+        journal) in one pass
+    '''
+    stats = CaptureStats(top)
+    sizes = []
+    payloads = _sized(pcap_reader.iter_payloads(
+        pcap_file, pcap_index.PROTOS[proto], src_addr, dst_addr), sizes)
+    if proto == 'tcp':
+        chunks = iter_soup_chunks(payloads, pcap_index.first_entry(),
+                                  chunk_size)
+    else:
+        chunks = iter_mold_chunks(payloads, chunk_size)
+    for chunk in chunks:
+        stats.update(chunk, sizes)
+        sizes.clear()
+    stats.finish()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tcp-pcaps', default=[], nargs='*',
+                        help='SoupBinTCP partitions, as pcap_file or '
+                        'pcap_file@src_ip:src_port')
+    parser.add_argument('--udp-pcaps', default=[], nargs='*',
+                        help='MoldUDP64 partitions (captures or journals), '
+                        'as pcap_file or pcap_file@group:port')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    total = 0
+    for proto, specs in (('tcp', args.tcp_pcaps), ('udp', args.udp_pcaps)):
+        for spec in specs:
+            pcap_file, addr = parse_addr(spec)
+            if proto == 'tcp':
+                stats = collect(pcap_file, proto, src_addr=addr,
+                                top=args.top)
+            else:
+                stats = collect(pcap_file, proto, dst_addr=addr,
+                                top=args.top)
+            stats.report(spec)
+            total += len(stats)
+    elapsed = time.perf_counter() - t0
+    print(f'{total} messages in {elapsed:.3f}s, '
+          f'{total / max(elapsed, 1e-9):.0f} msgs/s')
@@ -0,0 +1,504 @@
+import argparse
+import bisect
+import struct
+import time
+from collections import Counter
+import numpy as np
+import pcap_index
+import pcap_reader
+import itch_MoldUDP64
+import itch_SoupBinTCP_messages as im
+import data_messages as dm
+from itch_SoupBinTCP_decode import StreamDecoder
+from pcap_query import ITEMSIZE, be
+
+# SoupBinTCP packet size (packet type included) by packet type byte
+PACKET_SIZE = np.zeros(256, dtype=np.int64)
+for _pt, _msg_cls in im.MSG_TYPE_STRUCT_MAP.items():
+    PACKET_SIZE[_pt[0]] = _msg_cls.STRUCT.size
+SEQUENCED = ord('S')
+LOGIN_ACCEPTED = ord(im.LoginAcceptedPktMsg.PT)
+HEADER = itch_MoldUDP64.Header.STRUCT.size
+PEEL_ROUNDS = 8
+PADDING = bytes(128)
+
+
+class Report:
+    '''
+        problems found by kind, and the bad regions: runs of consecutive
+        bad messages (or packets) of a kind, as (kind, pcap record offset
+        and payload offset of the first one, how many or detail)
+    '''
+    KINDS = ('unknown type', 'bad length', 'unknown packet type',
+             'bad packet length', 'short block', 'bad count',
+             'partial frame', 'seq gap', 'seq repeat')
+
+    def __init__(self, max_regions=20):
+        self.counts = Counter()
+        self.regions = []
+        self.max_regions = max_regions
+        self.total_regions = 0
+        self.messages = 0
+        self.packets = 0
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, kind, bad, records, payload_offsets):
+        '''
+            bad: mask over messages (or packets), with the pcap record
+            offset and the payload offset of each
+        '''
+        idx = np.flatnonzero(bad)
+        if not len(idx):
+            return
+        self.counts[kind] += len(idx)
+        first = np.ones(len(idx), dtype=bool)
+        first[1:] = np.diff(idx) != 1
+        runs = np.flatnonzero(first)
+        lengths = np.diff(np.append(runs, len(idx)))
+        self.total_regions += len(runs)
+        room = max(self.max_regions - len(self.regions), 0)
+        for i, length in zip(idx[runs][:room].tolist(),
+                             lengths[:room].tolist()):
+            self.regions.append((kind, int(records[i]),
+                                 int(payload_offsets[i]), length))
+
+    def add_many(self, kinds, which, counts, records, payload_offsets,
+                 details):
+        '''
+            add_one for arrays of problems, of kinds[which[i]] each; details
+            is a tuple of a value or an array each, the detail of problem i
+            being their i-th values
+        '''
+        for i, kind in enumerate(kinds):
+            mine = which == i
+            if mine.any():
+                self.counts[kind] += int(counts[mine].sum())
+        self.total_regions += len(which)
+        room = max(self.max_regions - len(self.regions), 0)
+        columns = [d[:room].tolist() if isinstance(d, np.ndarray)
+                   else [d] * min(room, len(which)) for d in details]
+        for i, record, offset, *detail in zip(
+                which[:room].tolist(), records[:room].tolist(),
+                payload_offsets[:room].tolist(), *columns):
+            self.regions.append((kinds[i], record, offset, tuple(detail)))
+
+    def add_one(self, kind, count, record, payload_offset, detail):
+        self.counts[kind] += count
+        self.total_regions += 1
+        if len(self.regions) < self.max_regions:
+            self.regions.append((kind, record, payload_offset, detail))
+
+    def report(self):
+        print(f'{self.packets} packets, {self.messages} messages, '
+              f'{len(self)} problems in {self.total_regions} regions')
+        for kind in self.KINDS:
+            if self.counts[kind]:
+                print(f'    {kind}: {self.counts[kind]}')
+        for kind, record, offset, detail in self.regions:
+            print(f'    {kind} at record {record}, payload offset {offset}: '
+                  f'{detail}')
+
+
+def check_messages(report, buf, offsets, sizes, records, payload_offsets):
+    '''
+        ITCH messages at offsets of buf: known type, size of its STRUCT
+    '''
+    itemsize = ITEMSIZE[buf[offsets]]
+    report.add('unknown type', itemsize == 0, records, payload_offsets)
+    report.add('bad length', (itemsize > 0) & (sizes != itemsize),
+               records, payload_offsets)
+    report.messages += len(offsets)
+
+
+def iter_payload_chunks(pcap_file, proto, src_addr=None, dst_addr=None,
+                        chunk_size=1 << 22):
+    '''
+        the payloads of pcap_reader.iter_payloads, chunk_size bytes of the
+        file at a time: the record headers walked in Python, the Ethernet
+        (VLAN tags included) / IPv4 / TCP or UDP headers of all the records
+        at once with numpy
+        yield (pcap record offsets, payload offsets in the chunk bytes,
+        payload sizes, chunk bytes); the payloads are not copied out
+    '''
+    src_ip, src_port = (None, None) if src_addr is None else \
+        pcap_reader.pack_addr(src_addr)
+    dst_ip, dst_port = (None, None) if dst_addr is None else \
+        pcap_reader.pack_addr(dst_addr)
+    with open(pcap_file, 'rb') as f:
+        record = pcap_reader.PcapFormat(
+            f.read(pcap_reader.GLOBAL_HEADER_LEN)).record
+        # incl_len, the third field of a record header
+        incl_len = struct.Struct(record.format[0] + 'I').unpack_from
+        head_len = pcap_reader.RECORD_HEADER_LEN
+        base = pcap_reader.GLOBAL_HEADER_LEN
+        rest = b''
+        while True:
+            more = f.read(chunk_size)
+            # padded, so that header fields of short frames read as
+            # something
+            raw = rest + more + PADDING
+            n = len(raw) - len(PADDING)
+            heads = []
+            pos = 0
+            while pos + head_len <= n:
+                end = pos + head_len + incl_len(raw, pos + 8)[0]
+                if end > n:
+                    break
+                heads.append(pos)
+                pos = end
+            if heads:
+                # the records are back to back
+                heads = np.array(heads + [pos], dtype=np.int64)
+                frames = heads[:-1] + head_len
+                start, end = _payload_bounds(
+                    raw, frames, np.diff(heads) - head_len, proto,
+                    src_ip, src_port, dst_ip, dst_port)
+                keep = np.flatnonzero(end > start)
+                if len(keep):
+                    yield (base + heads[keep], start[keep],
+                           end[keep] - start[keep], raw)
+            base += pos
+            rest = raw[pos:n]
+            if not more:
+                return
+
+
+def _payload_bounds(raw, frames, lens, proto, src_ip, src_port, dst_ip,
+                    dst_port):
+    '''
+        (start, end) of the payload of each frame in raw (padded), as
+        pcap_reader.decode_ip and the address filter of iter_payloads; an
+        empty range for the frames skipped
+    '''
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    ip = frames + pcap_reader.ETH_HEADER_LEN
+    eth_type = be(buf, frames + 12, 2)
+    vlan = np.isin(eth_type, pcap_reader.ETH_TYPE_VLAN)
+    while vlan.any():
+        eth_type[vlan] = be(buf, ip[vlan] + 2, 2)
+        ip[vlan] += 4
+        vlan &= np.isin(eth_type, pcap_reader.ETH_TYPE_VLAN) & (
+            ip + 4 <= frames + lens)
+    ok = (eth_type == pcap_reader.ETH_TYPE_IPV4) & (ip + 20 <= frames + lens)
+    ok &= buf[ip + 9] == proto
+    l4 = ip + (buf[ip] & 0x0f).astype(np.int64) * 4
+    if proto == pcap_reader.IP_PROTO_TCP:
+        start = l4 + (buf[l4 + 12] >> 4).astype(np.int64) * 4
+    else:
+        start = l4 + 8
+    end = np.minimum(ip + be(buf, ip + 2, 2), frames + lens)
+    for addr, port, ip_at, port_at in ((src_ip, src_port, 12, 0),
+                                       (dst_ip, dst_port, 16, 2)):
+        if addr is not None:
+            ok &= be(buf, ip + ip_at, 4) == int.from_bytes(addr, 'big')
+        if port is not None:
+            ok &= be(buf, l4 + port_at, 2) == port
+    start = np.minimum(start, end)
+    return start, np.where(ok, end, start)
+
+
+def _walk_to(data, cand, pos):
+    '''
+        frames walked in Python from pos up to one at a candidate offset
+        (cand, a sorted list)
+        return (offsets of the frames walked, index of the candidate
+        reached or len(cand), offset reached)
+    '''
+    n = len(data)
+    starts = []
+    while pos + 2 <= n:
+        i = bisect.bisect_left(cand, pos)
+        if i < len(cand) and cand[i] == pos:
+            return starts, i, pos
+        end = pos + 2 + (data[pos] << 8 | data[pos + 1])
+        if end > n:
+            break
+        starts.append(pos)
+        pos = end
+    return starts, len(cand), pos
+
+
+def frame_walk(data):
+    '''
+        offsets of the SoupBinTCP frames of data, walked from its start by
+        the length prefixes as StreamDecoder.feed_block, and the offset
+        after the last complete one. The sequenced packets of a known type
+        and size are found all at once and linked to the candidate each
+        one ends at; only the other frames (and anything broken) are walked
+        in Python. The candidates off the walk (sequenced packet lookalikes
+        inside other frames) are then peeled off: each chain of them starts
+        at a candidate nothing links to.
+    '''
+    buf = np.frombuffer(data, dtype=np.uint8)
+    n = len(buf)
+    head = np.flatnonzero(buf[2:n - 1] == SEQUENCED)
+    lens = be(buf, head, 2)
+    nxt = head + 2 + lens
+    good = (nxt <= n) & (ITEMSIZE[buf[head + 3]] == lens - 1)
+    cand, nxt = head[good], nxt[good]
+    m = len(cand)
+    jump = np.searchsorted(cand, nxt)
+    broken = jump == m
+    broken[~broken] = cand[jump[~broken]] != nxt[~broken]
+    cands = cand.tolist()
+    walked = {}
+    for i, pos in zip(np.flatnonzero(broken).tolist(), nxt[broken].tolist()):
+        walked[i], jump[i], nxt[i] = _walk_to(data, cands, pos)
+    first, node, pos = _walk_to(data, cands, 0)
+    if node == m:
+        return np.array(first, dtype=np.int64), pos
+    links = np.bincount(jump, minlength=m + 1)
+    links[node] += 1
+    links[:node] = 0
+    on = np.ones(m + 1, dtype=bool)
+    on[:node] = False
+    off = np.flatnonzero(links[node:m] == 0) + node
+    for _ in range(PEEL_ROUNDS):
+        if not len(off):
+            break
+        on[off] = False
+        targets = jump[off]
+        links -= np.bincount(targets, minlength=m + 1)
+        off = np.unique(targets[(links[targets] == 0) & on[targets]])
+    if len(off):
+        # long chains off the walk, as when it lost its way: follow it
+        jumps = jump.tolist()
+        path = []
+        while node < m:
+            path.append(node)
+            node = jumps[node]
+        on = np.array(path, dtype=np.int64)
+    else:
+        on = np.flatnonzero(on[:m])
+    last = int(on[-1])
+    starts = [np.array(first, dtype=np.int64), cand[on]]
+    starts += [np.array(walked[i], dtype=np.int64)
+               for i in on[broken[on]].tolist()]
+    return np.sort(np.concatenate(starts)), int(nxt[last])
+
+
+def validate_soup(chunks, report):
+    '''
+        SoupBinTCP flow (iter_payload_chunks): the frame walk over the
+        length prefixes, packet types and sizes, the ITCH messages of the
+        sequenced packets, and the sequence numbers of Login Accepted
+        against the messages counted
+    '''
+    rest = b''
+    seq = None
+    for records, starts, sizes, chunk in chunks:
+        report.packets += len(records)
+        data = b''.join([chunk[s:e] for s, e in zip(
+            starts.tolist(), (starts + sizes).tolist())])
+        pending = len(rest)
+        ends = np.cumsum(sizes)
+        raw = rest + data
+        starts, stop = frame_walk(raw)
+        rest = raw[stop:]
+        if not len(starts):
+            continue
+        buf = np.frombuffer(raw, dtype=np.uint8)
+        # packet (and offset in it) each frame starts in; frames started
+        # in an earlier chunk are put on its first packet
+        pos = np.maximum(starts - pending, 0)
+        pkt = np.searchsorted(ends, pos, side='right')
+        pkt_offsets = pos - np.concatenate([[0], ends])[pkt]
+        pkt_records = records[pkt]
+        lens = be(buf, starts, 2)
+        ptype = buf[np.minimum(starts + 2, len(buf) - 1)]
+        ptype = np.where(lens > 0, ptype, 0)
+        sequenced = (lens > 0) & (ptype == SEQUENCED)
+        other = (lens > 0) & ~sequenced
+        known = PACKET_SIZE[ptype] > 0
+        report.add('unknown packet type', other & ~known, pkt_records,
+                   pkt_offsets)
+        report.add('bad packet length', (lens == 0) | (
+            other & known & (lens != PACKET_SIZE[ptype])), pkt_records,
+            pkt_offsets)
+        report.add('bad length', sequenced & (lens == 1), pkt_records,
+                   pkt_offsets)
+        msgs = np.flatnonzero(sequenced & (lens > 1))
+        check_messages(report, buf, starts[msgs] + 3, lens[msgs] - 1,
+                       pkt_records[msgs], pkt_offsets[msgs])
+        counted = np.cumsum(sequenced)
+        # the few logins, against the sequence numbers counted so far
+        login = np.flatnonzero((ptype == LOGIN_ACCEPTED) & (
+            lens == PACKET_SIZE[LOGIN_ACCEPTED]))
+        for i in login.tolist():
+            accepted = im.SoupBinTCPMsg.decode_seq_num(
+                raw[starts[i] + 13:starts[i] + 33])
+            before = int(counted[i])
+            if seq is not None:
+                expected = seq + before
+                if accepted > expected:
+                    report.add_one('seq gap', accepted - expected,
+                                   int(pkt_records[i]), int(pkt_offsets[i]),
+                                   (expected, accepted - 1))
+                elif accepted < expected:
+                    report.add_one('seq repeat', expected - accepted,
+                                   int(pkt_records[i]), int(pkt_offsets[i]),
+                                   (accepted, expected - 1))
+            seq = accepted - before
+        if seq is not None:
+            seq += int(counted[-1])
+    if rest:
+        report.add_one('partial frame', 1, -1, -1,
+                       f'{len(rest)} bytes left at the end')
+
+
+def validate_mold(chunks, report):
+    '''
+        MoldUDP64 packets: the message block walk of every packet at once
+        (one numpy step per block position, over the packets with blocks
+        left), message counts against the payload lengths, the ITCH
+        messages, and sequence numbers per session: each packet against the
+        highest end seen before it
+    '''
+    next_seq = {}
+    for records, base, sizes, data in chunks:
+        report.packets += len(records)
+        end = base + sizes
+        buf = np.frombuffer(data, dtype=np.uint8)
+        ok = sizes >= HEADER
+        report.add('short block', ~ok, records, np.zeros_like(records))
+        heads = np.flatnonzero(ok)
+        head_base = base[heads]
+        # the headers, gathered once: session, sequence number, count
+        header = buf[head_base[:, None] + np.arange(HEADER)]
+        count = np.zeros(len(records), dtype=np.int64)
+        count[heads] = header[:, 18:].copy().view('>u2').reshape(-1)
+        count[count == itch_MoldUDP64.END_OF_SESSION] = 0
+        pos = base + HEADER
+        offsets, lengths, owners = [], [], []
+        act = np.flatnonzero(count)
+        k = 0
+        while len(act):
+            at = pos[act]
+            room = end[act] - at
+            # a prefix past the end of the chunk is short whatever it reads
+            prefix = np.minimum(at, len(buf) - 2)
+            block_len = buf[prefix].astype(np.int64) << 8 | buf[prefix + 1]
+            short = room < 2 + block_len
+            if short.any():
+                report.add('short block', short, records[act], at - base[act])
+                ok[act[short]] = False
+                act, at, block_len = act[~short], at[~short], block_len[~short]
+            empty = block_len == 0
+            if empty.any():
+                report.add('bad length', empty, records[act], at - base[act])
+                full = ~empty
+                offsets.append(at[full] + 2)
+                lengths.append(block_len[full])
+                owners.append(act[full])
+            else:
+                offsets.append(at + 2)
+                lengths.append(block_len)
+                owners.append(act)
+            pos[act] = at + 2 + block_len
+            k += 1
+            act = act[count[act] > k]
+        report.add('bad count', ok & (pos != end), records, pos - base)
+        if offsets:
+            offsets = np.concatenate(offsets)
+            owners = np.concatenate(owners)
+            check_messages(report, buf, offsets, np.concatenate(lengths),
+                           records[owners], offsets - base[owners])
+        if not len(heads):
+            continue
+        first = header[:, 10:18].copy().view('>u8').reshape(-1).astype(
+            np.int64)
+        after = first + count[heads]
+        sessions = header[:, :10].copy().view('S10').reshape(-1)
+        if (header[:, :10] == header[0, :10]).all():
+            names, session_ids = sessions[:1], np.zeros(len(heads), int)
+        else:
+            names, session_ids = np.unique(sessions, return_inverse=True)
+            session_ids = session_ids.reshape(-1)
+        for sid, session in enumerate(names.tolist()):
+            rows = np.flatnonzero(session_ids == sid)
+            # where the highest packet so far ended, before each packet
+            high = np.maximum.accumulate(np.concatenate(
+                [[next_seq.get(session, first[rows[0]])], after[rows]]))
+            expected = high[:-1]
+            next_seq[session] = int(high[-1])
+            seq = first[rows]
+            gap = seq > expected
+            repeat = (seq < expected) & (count[heads[rows]] > 0)
+            bad = np.flatnonzero(gap | repeat)
+            if not len(bad):
+                continue
+            last = np.where(gap, seq, np.minimum(after[rows], expected)) - 1
+            lo = np.where(gap, expected, seq)
+            report.add_many(
+                ('seq repeat', 'seq gap'), gap[bad].astype(np.int64),
+                (last - lo + 1)[bad], records[heads[rows[bad]]],
+                np.full(len(bad), 10), (session, lo[bad], last[bad]))
+
+
+def validate(pcap_file, proto='tcp', src_addr=None, dst_addr=None,
+             max_regions=20, chunk_size=1 << 22):
+    report = Report(max_regions)
+    chunks = iter_payload_chunks(pcap_file, pcap_index.PROTOS[proto],
+                                 src_addr, dst_addr, chunk_size)
+    if proto == 'tcp':
+        validate_soup(chunks, report)
+    else:
+        validate_mold(chunks, report)
+    return report
+
+
+def decode_time(pcap_file, proto='tcp', src_addr=None, dst_addr=None):
+    '''
+        seconds a tolerant dict decode of the same payloads takes
+        (StreamDecoder or itch_MoldUDP64.decode), to compare validate with
+    '''
+    errors = dm.DecodeErrors()
+    decoder = StreamDecoder(errors)
+    t0 = time.perf_counter()
+    for _, _, payload in pcap_reader.iter_payloads(
+            pcap_file, pcap_index.PROTOS[proto], src_addr, dst_addr):
+        msgs = decoder.feed(payload) if proto == 'tcp' else \
+            itch_MoldUDP64.decode(payload, errors=errors)
+        for _ in msgs:
+            pass
+    return time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./tcp_partition4.pcap',
+                        help='a capture or a multicast_recv journal')
+    parser.add_argument('--proto', choices=pcap_index.PROTOS, default='tcp')
+    parser.add_argument('--src-ip', default=None)
+    parser.add_argument('--src-port', type=int, default=None)
+    parser.add_argument('--dst-ip', default=None)
+    parser.add_argument('--dst-port', type=int, default=None)
+    parser.add_argument('--max-regions', type=int, default=20)
+    parser.add_argument('--compare', type=int, default=0, metavar='RUNS',
+                        help='also time validate and a dict decode of the '
+                        'capture, best of RUNS each')
+    args = parser.parse_args()
+
+    src_addr = None if args.src_ip is None else (args.src_ip, args.src_port)
+    dst_addr = None if args.dst_ip is None else (args.dst_ip, args.dst_port)
+    t0 = time.perf_counter()
+    report = validate(args.pcap_file, args.proto, src_addr, dst_addr,
+                      args.max_regions)
+    elapsed = time.perf_counter() - t0
+    report.report()
+    print(f'checked in {elapsed:.3f}s, '
+          f'{report.messages / max(elapsed, 1e-9):.0f} msgs/s')
+    if args.compare:
+        # taken in turns, so that both see the same machine load
+        decoded = float('inf')
+        for _ in range(args.compare):
+            t0 = time.perf_counter()
+            validate(args.pcap_file, args.proto, src_addr, dst_addr)
+            elapsed = min(elapsed, time.perf_counter() - t0)
+            decoded = min(decoded, decode_time(args.pcap_file, args.proto,
+                                               src_addr, dst_addr))
+        print(f'best of {args.compare}: checked in {elapsed:.4f}s, dict '
+              f'decode in {decoded:.4f}s, {decoded / elapsed:.1f}x')
+    raise SystemExit(1 if len(report) else 0)
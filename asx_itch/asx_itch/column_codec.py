@@ -0,0 +1,186 @@
+import argparse
+import numpy as np
+
+GROUP = 'Order Book ID'
+SEVEN = np.arange(10, dtype=np.uint64) * np.uint64(7)
+
+
+def zigzag(x):
+    '''
+        int64 to uint64 with small magnitudes, either sign, made small
+    '''
+    x = np.asarray(x, dtype=np.int64)
+    return ((x << 1) ^ (x >> 63)).view(np.uint64)
+
+
+def unzigzag(z):
+    z = np.asarray(z, dtype=np.uint64)
+    return ((z >> np.uint64(1)) ^ (np.uint64(0) - (z & np.uint64(1)))).view(
+        np.int64)
+
+
+def varint_encode(values):
+    '''
+        LEB128 bytes (7 bits a byte, high bit set on all but the last
+        byte of a value) of a uint64 array, one numpy pass per byte position
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += values >= np.uint64(1) << SEVEN[k]
+    ends = np.cumsum(nbytes)
+    starts = ends - nbytes
+    out = np.zeros(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for k in range(int(nbytes.max()) if len(nbytes) else 0):
+        rows = np.flatnonzero(nbytes > k)
+        byte = (values[rows] >> SEVEN[k]) & np.uint64(0x7f)
+        byte |= np.where(nbytes[rows] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[rows] + k] = byte
+    return out
+
+
+def varint_decode(data, count=None):
+    '''
+        uint64 array of the varints in data (a uint8 array)
+    '''
+    data = np.frombuffer(data, dtype=np.uint8) if isinstance(
+        data, (bytes, bytearray, memoryview)) else data
+    last = data < 0x80
+    ends = np.flatnonzero(last)
+    if count is not None and len(ends) != count:
+        raise ValueError(f'{len(ends)} varints, {count} expected')
+    if not len(ends):
+        return np.zeros(0, dtype=np.uint64)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    # index of the value each byte belongs to, and its place in it
+    value = np.concatenate([[0], np.cumsum(last)[:-1]])
+    place = np.arange(len(data)) - starts[value]
+    parts = (data & 0x7f).astype(np.uint64) << SEVEN[place]
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def delta(x, group=None):
+    '''
+        differences to the previous value (int64, wrapping), within each
+        group (same value of group) when given; first values as they are
+    '''
+    x = np.asarray(x, dtype=np.int64)
+    if group is None:
+        return np.diff(x, prepend=np.int64(0))
+    order = np.argsort(group, kind='stable')
+    xs = x[order]
+    d = np.diff(xs, prepend=np.int64(0))
+    gs = np.asarray(group)[order]
+    first = np.ones(len(xs), dtype=bool)
+    first[1:] = gs[1:] != gs[:-1]
+    d[first] = xs[first]
+    out = np.empty_like(d)
+    out[order] = d
+    return out
+
+
+def undelta(d, group=None):
+    d = np.asarray(d, dtype=np.int64)
+    if group is None:
+        return np.cumsum(d)
+    order = np.argsort(group, kind='stable')
+    ds = d[order]
+    gs = np.asarray(group)[order]
+    first = np.ones(len(ds), dtype=bool)
+    first[1:] = gs[1:] != gs[:-1]
+    total = np.cumsum(ds)
+    # sum of the groups before each one
+    base = (total - ds)[first]
+    xs = total - base[np.cumsum(first) - 1]
+    out = np.empty_like(xs)
+    out[order] = xs
+    return out
+
+
+def as_int64(column):
+    if column.dtype.kind == 'u' and column.dtype.itemsize == 8:
+        return column.astype(np.uint64).view(np.int64)
+    return column.astype(np.int64)
+
+
+def from_int64(x, dtype):
+    if dtype.kind == 'u':
+        return x.view(np.uint64).astype(dtype)
+    return x.astype(dtype)
+
+
+def encode_column(column, group=None):
+    '''
+        (codec, bytes) of a column: integers as the smallest of zig-zag
+        varints of the values ('varint'), of their deltas ('delta') or of
+        their deltas within the group ('group'); anything else 'raw'
+    '''
+    if column.dtype.kind not in 'iu':
+        return 'raw', np.ascontiguousarray(column).tobytes()
+    x = as_int64(column)
+    candidates = [('varint', x), ('delta', delta(x))]
+    if group is not None:
+        candidates.append(('group', delta(x, group)))
+    codec, data = min(((codec, varint_encode(zigzag(v)))
+                       for codec, v in candidates), key=lambda c: len(c[1]))
+    return codec, data.tobytes()
+
+
+def decode_column(codec, data, dtype, rows, group=None):
+    if codec == 'raw':
+        return np.frombuffer(data, dtype=dtype, count=rows)
+    x = unzigzag(varint_decode(data, rows))
+    if codec == 'delta':
+        x = undelta(x)
+    elif codec == 'group':
+        x = undelta(x, group)
+    return from_int64(x, dtype)
+
+
+def encode_table(table, group=GROUP):
+    '''
+        (header, bytes) of a structured array, column by column, deltas
+        within the group column (Order Book ID) where that is smaller;
+        header is [(field, codec, size in bytes)]
+    '''
+    names = table.dtype.names
+    if group not in names:
+        group = None
+    header = []
+    parts = []
+    # the group column comes first, it is needed to decode the others
+    for name in sorted(names, key=lambda f: f != group):
+        codec, data = encode_column(
+            table[name], None if name == group else
+            None if group is None else table[group])
+        header.append((name, codec, len(data)))
+        parts.append(data)
+    return header, b''.join(parts)
+
+
+def decode_table(header, data, dtype, rows):
+    table = np.empty(rows, dtype=dtype)
+    group = None
+    offset = 0
+    for i, (name, codec, size) in enumerate(header):
+        table[name] = decode_column(codec, data[offset:offset + size],
+                                    dtype[name], rows, group)
+        if i == 0 and name == GROUP:
+            group = table[name].copy()
+        offset += size
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', help='an npy columnar_export directory')
+    args = parser.parse_args()
+
+    import columnar_export
+    for name, (table, stamps) in columnar_export.load(args.directory).items():
+        header, data = encode_table(table)
+        _, ts_data = encode_table(stamps.view([('Timestamp', '<i8')]))
+        raw = table.nbytes + stamps.nbytes
+        print(f'{name}: {raw} bytes to {len(data) + len(ts_data)} '
+              f'({raw / max(len(data) + len(ts_data), 1):.1f}x) ' +
+              ' '.join(f'{field}:{codec}' for field, codec, _ in header))
@@ -0,0 +1,245 @@
+import numpy as np
+import data_messages as dm
+
+STRUCT_CODE_DTYPE = {
+    'c': 'S1', 'B': 'u1', 'H': '>u2', 'L': '>u4', 'l': '>i4', 'Q': '>u8'}
+
+
+def struct_dtype(msg_cls):
+    '''
+        numpy dtype laid out exactly like msg_cls.STRUCT (packed, big endian)
+    '''
+    formats = [f'S{code[:-1]}' if code.endswith('s') else
+               STRUCT_CODE_DTYPE[code] for code in dm.field_formats(msg_cls)]
+    return np.dtype({'names': msg_cls.FIELDS, 'formats': formats})
+
+
+DTYPES = {mt: struct_dtype(msg_cls)
+          for mt, msg_cls in dm.MSG_TYPE_STRUCT_MAP.items()}
+CODE_DTYPE = np.dtype(np.uint32)
+
+
+def coded_dtype(dtype, mt):
+    '''
+        dtype (of an mt table, in full or projected) with the interned
+        fields (data_messages.INTERNED) as codes
+    '''
+    return np.dtype([
+        (f, CODE_DTYPE if f in dm.INTERNED.get(mt, ()) else dtype[f])
+        for f in dtype.names])
+
+
+class ColumnPlan:
+    '''
+        reduced columnar decode of message type mt to fields (and its
+        message type field): the packed dtype of the kept fields and the
+        byte positions of their values in a message, compiled once
+    '''
+    def __init__(self, mt, fields):
+        full = DTYPES[mt]
+        keep = set(fields) | {full.names[0]}
+        unknown = keep - set(full.names)
+        if unknown:
+            raise ValueError(f'{mt} has no field {unknown}')
+        names = [f for f in full.names if f in keep]
+        self.dtype = np.dtype([(f, full[f]) for f in names])
+        self.cols = np.concatenate([
+            np.arange(full.itemsize)[full.fields[f][1]:][:full[f].itemsize]
+            for f in names])
+
+
+def compile_projection(fields):
+    '''
+        {message type: ColumnPlan} from {message type: fields to keep}, for
+        BatchBuilder; types left out are kept in full. Batch.timestamps
+        needs 'Timestamp Nanoseconds' kept, and the Second of SecondsMsg.
+    '''
+    return {mt: ColumnPlan(mt, names) for mt, names in fields.items()}
+
+
+def gather(buf, offsets, mt, plan=None):
+    '''
+        table of the mt messages starting at offsets of buf (a uint8 array),
+        copied out with one numpy gather; with plan (ColumnPlan), only the
+        bytes of the fields kept are
+    '''
+    if plan is None:
+        dtype = DTYPES[mt]
+        cols = np.arange(dtype.itemsize)
+    else:
+        dtype, cols = plan.dtype, plan.cols
+    rows = buf[np.asarray(offsets)[:, None] + cols]
+    return rows.view(dtype).reshape(-1)
+
+
+def encode_strings(table, mt, intern):
+    '''
+        table (coded_dtype) with the interned fields of the mt table coded
+        by intern (data_messages.InternTable): the distinct values of each
+        column are found with numpy and only those go through the table
+    '''
+    coded = np.empty(len(table), dtype=coded_dtype(table.dtype, mt))
+    fields = dm.INTERNED.get(mt, ())
+    for f in coded.dtype.names:
+        if f in fields:
+            values, inverse = np.unique(table[f], return_inverse=True)
+            codes = np.array([intern.code(v) for v in values.tolist()],
+                             dtype=CODE_DTYPE)
+            coded[f] = codes[inverse.reshape(-1)]
+        else:
+            coded[f] = table[f]
+    return coded
+
+
+def decode_strings(codes, intern):
+    '''
+        the stripped values of an array of intern codes
+    '''
+    return np.array(intern.values, dtype=bytes)[codes]
+
+
+class Batch:
+    '''
+        columnar decode of ITCH messages: one structured array per message
+        type, the capture timestamps of each row, and the message types in
+        capture order (to put the rows back in order)
+    '''
+    def __init__(self, types=b'', tables=None, capture_ts=None):
+        self.types = types
+        self.tables = tables or {}
+        self.capture_ts = capture_ts or {}
+
+    def __len__(self):
+        return len(self.types)
+
+    def drop_head(self, n):
+        '''
+            batch without its first n messages
+        '''
+        head = self.types[:n]
+        tables = {}
+        capture_ts = {}
+        for mt, table in self.tables.items():
+            k = head.count(mt)
+            tables[mt] = table[k:]
+            capture_ts[mt] = self.capture_ts[mt][k:]
+        return Batch(self.types[n:], tables, capture_ts)
+
+    @classmethod
+    def concat(cls, batches):
+        batches = [b for b in batches if len(b)]
+        dtypes = {mt: table.dtype for b in batches[::-1]
+                  for mt, table in b.tables.items()}
+        return cls(
+            b''.join(b.types for b in batches),
+            {mt: np.concatenate([b.tables[mt] for b in batches
+                                 if mt in b.tables], dtype=dtype)
+             for mt, dtype in dtypes.items()},
+            {mt: np.concatenate([b.capture_ts[mt] for b in batches
+                                 if mt in b.tables]) for mt in dtypes})
+
+    def iter_rows(self):
+        '''
+            yield (message type, row, capture timestamp) in capture order
+        '''
+        pos = dict.fromkeys(self.tables, 0)
+        types = self.types
+        for i in range(len(types)):
+            mt = types[i:i + 1]
+            k = pos[mt]
+            pos[mt] = k + 1
+            yield mt, self.tables[mt][k], self.capture_ts[mt][k]
+
+    def timestamps(self, second=0):
+        '''
+            absolute time (epoch ns, as data_messages.Clock) of every row:
+            the seconds of the SecondsMsg rows are forward filled across
+            the batch, second being the one in force before it
+            return ({message type: int64 array}, second in force after it)
+        '''
+        types = np.frombuffer(self.types, dtype='S1')
+        seconds = np.array([second], dtype=np.int64)
+        if b'T' in self.tables:
+            seconds = np.concatenate([seconds, self.tables[b'T']['Second']])
+        # position in seconds of the second in force at each message
+        seconds = seconds[np.cumsum(types == b'T')] * dm.NS
+        stamps = {}
+        for mt, table in self.tables.items():
+            stamps[mt] = seconds[np.flatnonzero(types == mt)]
+            if 'Timestamp Nanoseconds' in table.dtype.names:
+                stamps[mt] += table['Timestamp Nanoseconds']
+        if len(types):
+            second = int(seconds[-1] // dm.NS)
+        return stamps, second
+
+    def iter_dicts(self, second=0):
+        '''
+            yield dicts as data_messages.decode_msg does, in capture order,
+            stamped as data_messages.Clock does; projected tables give the
+            fields they kept
+        '''
+        stamps, _ = self.timestamps(second)
+        pos = dict.fromkeys(self.tables, 0)
+        projection = dm.compile_projection({
+            mt: table.dtype.names for mt, table in self.tables.items()
+            if table.dtype != DTYPES[mt]})
+        for mt, row, _ in self.iter_rows():
+            plan = projection.get(mt)
+            if plan is None:
+                d = dm.decode_msg(row.tobytes(), mt)
+            else:
+                d = dict(zip(plan.FIELDS, plan.PACKED.unpack(row.tobytes())))
+                for k, xform in plan.POST_PROCESSING.items():
+                    d[k] = xform(d[k])
+            d['Timestamp'] = int(stamps[mt][pos[mt]])
+            pos[mt] += 1
+            yield d
+
+
+class BatchBuilder:
+    '''
+        collect raw ITCH messages (starting with the message type) and
+        decode them all at once with numpy; with projection
+        (compile_projection), only the fields kept make it to the tables
+    '''
+    def __init__(self, projection=None):
+        self.projection = projection or {}
+        self.types = bytearray()
+        self.parts = {}
+        self.capture_ts = {}
+
+    def __len__(self):
+        return len(self.types)
+
+    def append(self, raw, capture_ts=0.0, offset=0):
+        '''
+            return False (and keep nothing) for unknown types or short
+            messages; trailing bytes are ignored like decode_msg does
+        '''
+        mt = raw[offset:offset + 1]
+        dtype = DTYPES.get(mt)
+        if dtype is None or len(raw) - offset < dtype.itemsize:
+            return False
+        if mt not in self.parts:
+            self.parts[mt] = []
+            self.capture_ts[mt] = []
+        self.parts[mt].append(raw[offset:offset + dtype.itemsize])
+        self.capture_ts[mt].append(capture_ts)
+        self.types += mt
+        return True
+
+    def _table(self, mt):
+        data = b''.join(self.parts[mt])
+        plan = self.projection.get(mt)
+        if plan is None:
+            return np.frombuffer(data, DTYPES[mt])
+        size = DTYPES[mt].itemsize
+        return gather(np.frombuffer(data, np.uint8),
+                      np.arange(0, len(data), size), mt, plan)
+
+    def build(self):
+        return Batch(
+            bytes(self.types),
+            {mt: self._table(mt) for mt in self.parts},
+            {mt: np.array(ts, dtype=np.float64)
+             for mt, ts in self.capture_ts.items()})
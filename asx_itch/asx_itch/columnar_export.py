@@ -0,0 +1,343 @@
+import argparse
+import json
+import os
+import struct
+import numpy as np
+import data_messages as dm
+import column_codec
+from columnar import encode_strings, decode_strings
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('npy', 'npz', 'parquet', 'varint')
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+TS_DTYPE = np.dtype('<i8')
+CHUNK_HEADER = struct.Struct('<I')
+EXTENSIONS = {'npy': '.npy', 'npz': '.npy', 'varint': '.vi'}
+
+
+def table_name(mt):
+    return dm.MSG_TYPE_STRUCT_MAP[mt].__name__
+
+
+def npy_header(dtype, rows, size=None):
+    '''
+        .npy (v1.0) header for rows of dtype, padded to size bytes so that
+        it can be rewritten in place once the row count is known
+    '''
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype),
+                   'fortran_order': False, 'shape': (rows,)}).encode()
+    if size is None:
+        # room for any row count, 64 byte aligned
+        size = -(-(len(NPY_MAGIC) + 2 + len(header) + 21) // 64) * 64
+    header = header.ljust(size - len(NPY_MAGIC) - 3) + b'\n'
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header
+
+
+class NpyAppender:
+    '''
+        .npy file written a chunk of rows at a time
+    '''
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = dtype
+        self.rows = 0
+        self.file = open(path, 'wb', buffering=1 << 20)
+        self.header_size = len(npy_header(dtype, 0))
+        self.file.write(npy_header(dtype, 0))
+
+    def append(self, rows):
+        self.file.write(np.ascontiguousarray(rows, self.dtype).tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, self.rows, self.header_size))
+        self.file.close()
+
+
+class VarintAppender:
+    '''
+        column_codec file written a chunk of rows at a time: each chunk is
+        a json header (rows, [(field, codec, size)]) and the encoded
+        columns, so it decodes on its own
+    '''
+    def __init__(self, path, dtype):
+        self.path = path
+        self.rows = 0
+        self.file = open(path, 'wb', buffering=1 << 20)
+
+    def append(self, rows):
+        if rows.dtype.names is None:
+            rows = rows.view([('', rows.dtype)])
+        header, data = column_codec.encode_table(rows)
+        header = json.dumps([len(rows), header]).encode()
+        self.file.write(CHUNK_HEADER.pack(len(header)) + header + data)
+        self.rows += len(rows)
+
+    def close(self):
+        self.file.close()
+
+
+def read_varint(path, dtype):
+    '''
+        the rows of a VarintAppender file
+        (decoded a chunk at a time)
+    '''
+    with open(path, 'rb') as f:
+        raw = f.read()
+    plain = dtype.names is None
+    dtype = np.dtype([('f0', dtype)]) if plain else dtype
+    chunks = []
+    offset = 0
+    while offset < len(raw):
+        size, = CHUNK_HEADER.unpack_from(raw, offset)
+        offset += CHUNK_HEADER.size
+        rows, header = json.loads(raw[offset:offset + size])
+        offset += size
+        data_size = sum(s for _, _, s in header)
+        chunks.append(column_codec.decode_table(
+            header, raw[offset:offset + data_size], dtype, rows))
+        offset += data_size
+    table = np.concatenate(chunks, dtype=dtype) if chunks else \
+        np.zeros(0, dtype)
+    return table['f0'] if plain else table
+
+
+class ParquetAppender:
+    '''
+        .parquet file written a row group at a time; alphanumeric fields
+        as binary, numbers in native byte order
+    '''
+    def __init__(self, path, dtype):
+        self.path = path
+        self.rows = 0
+        self.writer = None
+
+    def append(self, rows):
+        table = pyarrow.table({
+            name: rows[name] if rows.dtype[name].kind == 'S'
+            else rows[name].astype(rows.dtype[name].newbyteorder('='))
+            for name in rows.dtype.names})
+        if self.writer is None:
+            self.writer = pyarrow.parquet.ParquetWriter(
+                self.path, table.schema)
+        self.writer.write_table(table)
+        self.rows += len(rows)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ColumnarWriter:
+    '''
+        per message type columnar files in directory, from columnar.Batch:
+        <MsgClass>.npy holds the messages as received (columnar.DTYPES,
+        from STRUCT and FIELDS, or the fields a projection kept; each type
+        keeps the dtype of its first table), <MsgClass>.ts.npy their
+        absolute times (epoch ns); schema.json describes them. Rows are
+        buffered and appended chunk_rows at a time. 'npz' packs the .npy
+        files in one itch.npz at close, 'parquet' writes one
+        <MsgClass>.parquet per type, timestamps included (needs pyarrow),
+        'varint' <MsgClass>.vi and <MsgClass>.ts.vi files of column_codec
+        chunks. With intern (data_messages.InternTable), the alphanumeric
+        fields are written as codes (columnar.coded_dtype) and the values
+        in strings.npy.
+    '''
+    def __init__(self, directory, fmt='npy', chunk_rows=1 << 16,
+                 intern=None):
+        if fmt == 'parquet' and pyarrow is None:
+            raise ImportError('parquet export needs pyarrow')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fmt = fmt
+        self.chunk_rows = chunk_rows
+        self.intern = intern
+        self.dtypes = {}
+        self.second = 0
+        self.pending = {}
+        self.files = {}
+
+    def _files(self, mt):
+        if mt not in self.files:
+            base = os.path.join(self.directory, table_name(mt))
+            if self.fmt == 'parquet':
+                dtype = np.dtype(self.dtypes[mt].descr +
+                                 [('Timestamp', '<i8')])
+                self.files[mt] = (ParquetAppender(base + '.parquet', dtype),)
+            else:
+                appender = VarintAppender if self.fmt == 'varint' \
+                    else NpyAppender
+                ext = EXTENSIONS[self.fmt]
+                self.files[mt] = (appender(base + ext, self.dtypes[mt]),
+                                  appender(base + '.ts' + ext, TS_DTYPE))
+        return self.files[mt]
+
+    def write(self, batch):
+        '''
+            append a batch; batches must come in capture order (the
+            seconds are carried from one to the next)
+        '''
+        stamps, self.second = batch.timestamps(self.second)
+        for mt, table in batch.tables.items():
+            if self.intern is not None and mt in dm.INTERNED:
+                table = encode_strings(table, mt, self.intern)
+            dtype = self.dtypes.setdefault(mt, table.dtype)
+            if table.dtype != dtype:
+                raise ValueError(f'{mt} tables of dtype {table.dtype} '
+                                 f'after {dtype}')
+            parts = self.pending.setdefault(mt, [])
+            parts.append((table, stamps[mt]))
+            if sum(len(t) for t, _ in parts) >= self.chunk_rows:
+                self._flush(mt)
+
+    def _flush(self, mt):
+        parts = self.pending.pop(mt, [])
+        if not parts:
+            return
+        dtype = self.dtypes[mt]
+        table = np.concatenate([t for t, _ in parts], dtype=dtype)
+        stamps = np.concatenate([s for _, s in parts])
+        files = self._files(mt)
+        if self.fmt == 'parquet':
+            rows = np.empty(len(table), dtype=np.dtype(
+                dtype.descr + [('Timestamp', '<i8')]))
+            for name in dtype.names:
+                rows[name] = table[name]
+            rows['Timestamp'] = stamps
+            files[0].append(rows)
+        else:
+            files[0].append(table)
+            files[1].append(stamps)
+
+    def close(self):
+        for mt in list(self.pending):
+            self._flush(mt)
+        schema = {}
+        for mt, files in sorted(self.files.items()):
+            for f in files:
+                f.close()
+            msg_cls = dm.MSG_TYPE_STRUCT_MAP[mt]
+            schema[table_name(mt)] = {
+                'message type': mt.decode(),
+                'fields': list(self.dtypes[mt].names),
+                'struct': msg_cls.STRUCT.format,
+                'dtype': np.lib.format.dtype_to_descr(self.dtypes[mt]),
+                'rows': files[0].rows}
+            if self.intern is not None:
+                schema[table_name(mt)]['interned'] = [
+                    f for f in dm.INTERNED.get(mt, ())
+                    if f in self.dtypes[mt].names]
+        strings = None
+        if self.intern is not None:
+            strings = np.array(self.intern.values, dtype=bytes)
+            if self.fmt != 'npz':
+                np.save(os.path.join(self.directory, 'strings.npy'), strings)
+        if self.fmt == 'npz':
+            arrays = {} if strings is None else {'strings': strings}
+            for mt, (data, stamps) in self.files.items():
+                arrays[table_name(mt)] = np.load(data.path)
+                arrays[table_name(mt) + '.ts'] = np.load(stamps.path)
+            np.savez(os.path.join(self.directory, 'itch.npz'), **arrays)
+            for data, stamps in self.files.values():
+                os.remove(data.path)
+                os.remove(stamps.path)
+        with open(os.path.join(self.directory, 'schema.json'), 'w') as f:
+            json.dump({'format': self.fmt, 'interned': strings is not None,
+                       'tables': schema}, f, indent=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load(directory, mmap=True, strings=False):
+    '''
+        {MsgClass name: (messages, absolute times)} of an npy, npz or
+        varint export, memory mapped for npy; with strings, the interned
+        fields of an export written with an intern table come back as their
+        (stripped) values instead of codes
+    '''
+    with open(os.path.join(directory, 'schema.json')) as f:
+        schema = json.load(f)
+    tables = _load(directory, schema, mmap)
+    intern = load_strings(directory) if strings else None
+    if intern is None:
+        return tables
+    return {name: (with_strings(table, schema['tables'][name]['interned'],
+                                intern), stamps)
+            for name, (table, stamps) in tables.items()}
+
+
+def _load(directory, schema, mmap):
+    if schema['format'] == 'varint':
+        tables = {}
+        for name, table in schema['tables'].items():
+            base = os.path.join(directory, name)
+            dtype = np.lib.format.descr_to_dtype(
+                [tuple(f) for f in table['dtype']])
+            tables[name] = (read_varint(base + '.vi', dtype),
+                            read_varint(base + '.ts.vi', TS_DTYPE))
+        return tables
+    if schema['format'] == 'npz':
+        npz = np.load(os.path.join(directory, 'itch.npz'))
+        return {name: (npz[name], npz[name + '.ts'])
+                for name in schema['tables']}
+    mode = 'r' if mmap else None
+    return {name: (np.load(os.path.join(directory, name + '.npy'), mode),
+                   np.load(os.path.join(directory, name + '.ts.npy'), mode))
+            for name in schema['tables']}
+
+
+def load_strings(directory):
+    '''
+        data_messages.InternTable of an export written with one (codes as
+        exported), None otherwise
+    '''
+    with open(os.path.join(directory, 'schema.json')) as f:
+        schema = json.load(f)
+    if not schema.get('interned'):
+        return None
+    if schema['format'] == 'npz':
+        strings = np.load(os.path.join(directory, 'itch.npz'))['strings']
+    else:
+        strings = np.load(os.path.join(directory, 'strings.npy'))
+    return dm.InternTable(strings.tolist())
+
+
+def with_strings(table, fields, intern):
+    '''
+        copy of table with the intern code columns in fields replaced by
+        their values (columnar.decode_strings)
+    '''
+    values = {f: decode_strings(table[f], intern) for f in fields}
+    dtype = np.dtype([(f, values[f].dtype if f in values
+                       else table.dtype[f]) for f in table.dtype.names])
+    decoded = np.empty(len(table), dtype=dtype)
+    for f in dtype.names:
+        decoded[f] = values[f] if f in values else table[f]
+    return decoded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory')
+    parser.add_argument('--strings', action='store_true',
+                        help='print the first row of each table, interned '
+                        'fields as values')
+    args = parser.parse_args()
+
+    for name, (table, stamps) in load(args.directory,
+                                      strings=args.strings).items():
+        span = f'{stamps[0] / dm.NS:.9f} - {stamps[-1] / dm.NS:.9f}' \
+            if len(stamps) else ''
+        print(f'{name}: {len(table)} rows {span}')
+        if args.strings and len(table):
+            print(f'    {table[0]}')
@@ -1,4 +1,6 @@
+import re
 import struct
+from collections import Counter, defaultdict
 
 
 class MarketMsg:
@@ -213,22 +215,202 @@ class EndOfSnapshotMsg(MarketMsg):
 MSG_TYPE_STRUCT_MAP = {msg_cls.MT: msg_cls
                        for msg_cls in MarketMsg.__subclasses__()}
 
+STRING_FIELDS = ('Participant ID, owner', 'Participant ID, counterparty',
+                 'Participant ID', 'Symbol', 'Long Name', 'ISIN',
+                 'State Name')
+INTERNED = {mt: [f for f in msg_cls.FIELDS if f in STRING_FIELDS]
+            for mt, msg_cls in MSG_TYPE_STRUCT_MAP.items()
+            if set(msg_cls.FIELDS) & set(STRING_FIELDS)}
 
-def decode_msg(raw, msg_type, offset=0):
+NS = 1000000000
+
+
+def field_formats(msg_cls):
+    '''
+        the struct format of each field of msg_cls, in FIELDS order
+    '''
+    formats = []
+    for count, code in re.findall(r'(\d*)([a-zA-Z])', msg_cls.STRUCT.format):
+        if code == 's':
+            formats.append(count + code)
+        else:
+            formats.extend([code] * int(count or 1))
+    return formats
+
+
+class DecodePlan:
+    '''
+        reduced decode of msg_cls to fields (and its message type field):
+        the fields left out are pad bytes of one struct compiled once, so
+        only the kept ones get unpacked and post processed. PACKED unpacks
+        the kept fields laid out back to back (a projected columnar row).
+        Quacks like a MarketMsg class for decode_msg.
+    '''
+    def __init__(self, msg_cls, fields):
+        keep = set(fields) | {msg_cls.FIELDS[0]}
+        unknown = keep - set(msg_cls.FIELDS)
+        if unknown:
+            raise ValueError(f'{msg_cls.__name__} has no field {unknown}')
+        fmt = packed = '!'
+        skip = 0
+        self.FIELDS = []
+        for name, code in zip(msg_cls.FIELDS, field_formats(msg_cls)):
+            if name not in keep:
+                skip += struct.calcsize('!' + code)
+                continue
+            if skip:
+                fmt += f'{skip}x'
+                skip = 0
+            fmt += code
+            packed += code
+            self.FIELDS.append(name)
+        self.MT = msg_cls.MT
+        self.STRUCT = struct.Struct(fmt)
+        self.PACKED = struct.Struct(packed)
+        self.POST_PROCESSING = {
+            k: xform for k, xform in getattr(
+                msg_cls, 'POST_PROCESSING', {}).items() if k in keep}
+
+    def decode_zip_name(self, raw, offset=0):
+        return dict(zip(self.FIELDS, self.STRUCT.unpack_from(raw, offset)))
+
+
+def compile_projection(fields):
+    '''
+        {message type: DecodePlan} from {message type: fields to keep}, for
+        the decoders' projection argument; types left out decode in full.
+        Absolute times (Clock) need 'Timestamp Nanoseconds' kept, and the
+        Second of SecondsMsg.
+    '''
+    return {mt: DecodePlan(MSG_TYPE_STRUCT_MAP[mt], names)
+            for mt, names in fields.items()}
+
+
+class Clock:
+    '''
+        absolute message time: the Second of the last SecondsMsg of the
+        session plus the message's Timestamp Nanoseconds, set as 'Timestamp'
+        (epoch nanoseconds); second is assumed for sessions with no
+        SecondsMsg yet
+    '''
+    def __init__(self, second=0):
+        self.second = second
+        self.seconds = {}
+
+    def stamp(self, d, session=None):
+        if d.get('Message Type') == b'T':
+            self.seconds[session] = d['Second']
+            d['Timestamp'] = d['Second'] * NS
+        else:
+            d['Timestamp'] = (self.seconds.get(session, self.second) * NS +
+                              d.get('Timestamp Nanoseconds', 0))
+        return d
+
+
+class InternTable:
+    '''
+        dictionary encoding of the padded alphanumeric fields (INTERNED):
+        each distinct value gets a small integer code the first time it is
+        seen, and is stripped of its padding then only; values[code] is the
+        stripped value. Meant to be shared by everything decoding a session.
+    '''
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.code(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def code(self, raw):
+        code = self.codes.get(raw)
+        if code is None:
+            value = raw.rstrip(b' \x00')
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            self.codes[raw] = code
+        return code
+
+
+class DecodeErrors:
+    '''
+        error counters for tolerant decoding: decoders given one count the
+        problem by kind, skip the bad block and keep going instead of
+        raising; context is set by the caller (e.g. packet capture time) and
+        kept with the first samples of each kind
+    '''
+    KINDS = ('unknown type', 'short block', 'bad length')
+
+    def __init__(self, samples=10):
+        self.counts = Counter()
+        self.samples = defaultdict(list)
+        self.max_samples = samples
+        self.context = None
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def record(self, kind, offset, detail=None):
+        self.counts[kind] += 1
+        if len(self.samples[kind]) < self.max_samples:
+            self.samples[kind].append((self.context, offset, detail))
+
+    def report(self):
+        print(f'{len(self)} decode errors')
+        for kind in self.KINDS:
+            if self.counts[kind]:
+                print(f'    {kind}: {self.counts[kind]}')
+                for context, offset, detail in self.samples[kind]:
+                    print(f'        at {context}, offset {offset}: {detail}')
+
+
+def decode_msg(raw, msg_type, offset=0, errors=None, block_len=None,
+               intern=None, projection=None):
     '''
         decode one message (starting with the message type)
+        with errors (DecodeErrors), bad messages are counted there and None
+        is returned instead; block_len is the length given by the framing;
+        with intern (InternTable), the INTERNED fields come as codes; with
+        projection (compile_projection), only the fields kept are decoded
     '''
+    if errors is not None:
+        struct_ = MSG_TYPE_STRUCT_MAP.get(msg_type)
+        if struct_ is None:
+            errors.record('unknown type', offset, msg_type)
+            return None
+        size = struct_.STRUCT.size
+        if block_len is not None and block_len < size:
+            errors.record('bad length', offset, (msg_type, block_len, size))
+            return None
+        if offset + size > len(raw):
+            errors.record('short block', offset,
+                          (msg_type, len(raw) - offset, size))
+            return None
     if msg_type in MSG_TYPE_STRUCT_MAP:
         struct_ = MSG_TYPE_STRUCT_MAP[msg_type]
+        if projection is not None:
+            struct_ = projection.get(msg_type, struct_)
         try:
             d = struct_.decode_zip_name(raw, offset)
             if hasattr(struct_, 'POST_PROCESSING'):
                 for k, xform in struct_.POST_PROCESSING.items():
                     d[k] = xform(d[k])
+            if intern is not None and msg_type in INTERNED:
+                for k in INTERNED[msg_type]:
+                    if k in d:
+                        d[k] = intern.code(d[k])
             return d
         except struct.error as e:
+            remain = raw[offset:offset + struct_.STRUCT.size]
             raise Exception(
-                'raw:', raw[offset:],
-                ', raw len', len(raw[offset:])) from e
+                'raw:', bytes(remain),
+                ', raw len', len(raw) - offset) from e
     else:
-        return {'error': f'offset = {offset}, msg_type={msg_type}, raw={raw}'}
+        return {'error': f'offset = {offset}, msg_type={msg_type}, '
+                         f'raw={bytes(raw[offset:offset + 64])}'}
@@ -0,0 +1,148 @@
+import argparse
+import threading
+import time
+import itch_MoldUDP64
+import multicast_recv
+from book_checkpoint import Checkpointer
+from glimpse_client import GlimpseClient
+from order_book import OrderBook
+from pcap_mold_extract import SeqTracker
+
+
+class SyncEngine:
+    '''
+        merge a Glimpse snapshot with the MoldUDP64 incremental feed: the
+        packets received while the snapshot loads are kept raw (up to
+        max_buffer bytes), then replayed in sequence order once the
+        snapshot sequence number is known, dropping the messages at or below
+        it; after that packets are applied as they come
+        checkpointer: a book_checkpoint.Checkpointer fed as packets apply
+    '''
+    def __init__(self, book=None, max_buffer=64 << 20, checkpointer=None):
+        self.book = OrderBook() if book is None else book
+        self.checkpointer = checkpointer
+        self.max_buffer = max_buffer
+        self.buffer = []
+        self.buffered = 0
+        self.tracker = SeqTracker()
+        self.snapshot_seq = None
+        self.overflow = False
+        self.dropped = 0
+        self.applied = 0
+        self.replayed = 0
+        self.lock = threading.Lock()
+
+    @property
+    def live(self):
+        return self.snapshot_seq is not None
+
+    def on_packet(self, raw):
+        if len(raw) < itch_MoldUDP64.Header.STRUCT.size:
+            return
+        with self.lock:
+            if self.live:
+                self.apply(raw)
+                return
+            if self.overflow:
+                return
+            self.buffered += len(raw)
+            if self.buffered > self.max_buffer:
+                # nothing can be replayed consistently any more
+                self.overflow = True
+                self.buffer = []
+                return
+            self.buffer.append((itch_MoldUDP64.decode_header(raw)[1], raw))
+
+    def go_live(self, snapshot_seq):
+        '''
+            the snapshot holds every message up to snapshot_seq: replay the
+            buffered packets after it, in order
+        '''
+        with self.lock:
+            if self.overflow:
+                raise BufferError(
+                    f'more than {self.max_buffer} bytes of incremental '
+                    'packets before the end of the snapshot')
+            self.snapshot_seq = snapshot_seq
+            self.buffer.sort(key=lambda packet: packet[0])
+            for _, raw in self.buffer:
+                self.apply(raw)
+            self.buffer = []
+            self.buffered = 0
+            self.replayed = self.applied
+
+    def apply(self, raw):
+        session, seq, count = itch_MoldUDP64.decode_header(raw)
+        if count == itch_MoldUDP64.END_OF_SESSION:
+            count = 0
+        # the leading messages the snapshot already holds
+        stale = max(min(self.snapshot_seq + 1 - seq, count), 0)
+        self.dropped += stale
+        if count and stale == count:
+            return
+        if session not in self.tracker.next_seq:
+            self.tracker.next_seq[session] = self.snapshot_seq + 1
+        seen = stale + self.tracker.update(session, seq + stale, count - stale)
+        for i, d in enumerate(itch_MoldUDP64.decode(raw)):
+            if i >= seen and d:
+                self.book.apply(d)
+                self.applied += 1
+        if self.checkpointer is not None and count > seen:
+            self.checkpointer.update(self.book, session, seq + count - 1,
+                                     count - seen)
+
+    def receive(self, sock, size=65535):
+        while True:
+            self.on_packet(sock.recv(size))
+
+
+def sync(client, sock, engine=None):
+    '''
+        load the snapshot with client (a GlimpseClient) while buffering the
+        packets of sock, then go live
+        return (engine, time to live state in seconds)
+    '''
+    engine = SyncEngine(client.book) if engine is None else engine
+    t0 = time.perf_counter()
+    threading.Thread(target=engine.receive, args=(sock,), daemon=True).start()
+    engine.go_live(client.load())
+    return engine, time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--glimpse-ip', default='192.168.56.102')
+    parser.add_argument('--glimpse-port', type=int, default=21800)
+    parser.add_argument('--username', default='')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--port', type=int, default=19900)
+    parser.add_argument('--join-mcast-groups', default=[], nargs='*',
+                        help='multicast groups (ip addrs) to listen to join')
+    parser.add_argument('--iface', default=None)
+    parser.add_argument('--bind-group', default=None)
+    parser.add_argument('--max-buffer', type=int, default=64 << 20,
+                        help='bytes of incremental packets kept while the '
+                        'snapshot loads')
+    parser.add_argument('--checkpoint-dir', default=None,
+                        help='checkpoint the book there once live')
+    parser.add_argument('--checkpoint-every', type=int, default=1000000,
+                        help='messages between checkpoints')
+    args = parser.parse_args()
+
+    checkpointer = None if args.checkpoint_dir is None else Checkpointer(
+        args.checkpoint_dir, args.checkpoint_every)
+    sock = multicast_recv.join(args.join_mcast_groups, args.port, args.iface,
+                               args.bind_group)
+    client = GlimpseClient(args.glimpse_ip, args.glimpse_port,
+                           args.username.encode(), args.password.encode())
+    engine, elapsed = sync(client, sock,
+                           SyncEngine(client.book, args.max_buffer,
+                                      checkpointer))
+    client.report()
+    print(f'live at seq {engine.snapshot_seq} after {elapsed:.3f}s: '
+          f'{engine.replayed} buffered messages replayed, '
+          f'{engine.dropped} already in the snapshot')
+    while True:
+        time.sleep(10)
+        print(f'{engine.applied} messages applied, {len(engine.book)} orders')
+        engine.tracker.report()
@@ -0,0 +1,164 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+from array import array
+import numpy as np
+import pcap_reader
+from itch_SoupBinTCP_decode import StreamDecoder
+from pcap_index import flow_name
+
+DEFAULT_SESSION = b'GLIMPSE001'
+
+
+class SnapshotCache:
+    '''
+        a snapshot as one pre-framed SoupBinTCP byte stream of sequenced data
+        packets (<path>.soup, memory mapped) and the byte offset of every
+        sequence number (<path>.idx.npy, offsets[seq - 1], plus the end)
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        self.session = meta['session'].encode()
+        self.stream_file = path + '.soup'
+        self.offsets = np.load(path + '.idx.npy', mmap_mode='r')
+        self.size = int(self.offsets[-1])
+        with open(self.stream_file, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                if self.size else b''
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def span(self, seq=1, end_seq=None):
+        '''
+            (byte offset, byte count) of the packets from seq up to (not
+            including) end_seq
+        '''
+        end_seq = len(self) + 1 if end_seq is None else end_seq
+        seq = min(max(seq, 1), len(self) + 1)
+        end_seq = min(max(end_seq, seq), len(self) + 1)
+        start = int(self.offsets[seq - 1])
+        return start, int(self.offsets[end_seq - 1]) - start
+
+    def view(self, seq=1, end_seq=None):
+        start, count = self.span(seq, end_seq)
+        return memoryview(self.mmap)[start:start + count]
+
+    @classmethod
+    def write(cls, path, frames, session=DEFAULT_SESSION):
+        '''
+            build a cache from SoupBinTCP packets: sequenced data packets are
+            kept, a LoginAccepted sets the session
+        '''
+        offsets = array('Q', [0])
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp + '.soup', 'wb', buffering=1 << 20) as f:
+            for raw in frames:
+                if raw[2:3] == b'S':
+                    f.write(raw)
+                    offsets.append(offsets[-1] + len(raw))
+                elif raw[2:3] == b'A':
+                    session = bytes(raw[3:13])
+        return cls._finish(tmp, path, np.frombuffer(offsets, np.uint64),
+                           session)
+
+    @classmethod
+    def write_blocks(cls, path, blocks, session=DEFAULT_SESSION):
+        '''
+            build a cache from (pre-framed sequenced data packets, packet
+            lengths) blocks
+        '''
+        lengths = []
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp + '.soup', 'wb') as f:
+            for raw, frame_lengths in blocks:
+                f.write(raw)
+                lengths.append(np.asarray(frame_lengths, dtype=np.uint64))
+        offsets = np.zeros(sum(map(len, lengths)) + 1, dtype=np.uint64)
+        if lengths:
+            np.cumsum(np.concatenate(lengths), out=offsets[1:])
+        return cls._finish(tmp, path, offsets, session)
+
+    @classmethod
+    def _finish(cls, tmp, path, offsets, session):
+        np.save(tmp + '.idx.npy', offsets)
+        with open(tmp + '.json', 'w') as f:
+            json.dump({'session': session.decode(),
+                       'messages': len(offsets) - 1}, f)
+        # json last: its presence marks a complete cache
+        for ext in ('.soup', '.idx.npy', '.json'):
+            os.replace(tmp + ext, path + ext)
+        return cls(path)
+
+
+def iter_pcap_frames(pcap_file, src_addr, dst_addr):
+    decoder = StreamDecoder()
+    for _, _, payload in pcap_reader.iter_payloads(
+            pcap_file, pcap_reader.IP_PROTO_TCP, src_addr, dst_addr):
+        yield from decoder.feed_frames(payload)
+
+
+def pcap_digest(pcap_file, cache_dir):
+    '''
+        content hash of the capture, remembered per (size, mtime) so that
+        it is computed once
+    '''
+    digests_file = os.path.join(cache_dir, 'digests.json')
+    digests = {}
+    if os.path.exists(digests_file):
+        with open(digests_file) as f:
+            digests = json.load(f)
+    st = os.stat(pcap_file)
+    key = os.path.abspath(pcap_file)
+    stamp = [st.st_size, st.st_mtime_ns]
+    if key in digests and digests[key][:2] == stamp:
+        return digests[key][2]
+    h = hashlib.sha1()
+    with open(pcap_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    digests[key] = stamp + [h.hexdigest()]
+    with open(digests_file + '.tmp', 'w') as f:
+        json.dump(digests, f)
+    os.replace(digests_file + '.tmp', digests_file)
+    return h.hexdigest()
+
+
+def load(pcap_file='./tcp_partition4.pcap',
+         src_addr=('203.0.119.230', 21804),
+         dst_addr=('10.31.38.4', 45793),
+         cache_dir=None):
+    '''
+        the cache of the snapshot sent from src_addr to dst_addr in a
+        capture, built on first use
+    '''
+    cache_dir = cache_dir or os.path.join(
+        os.path.dirname(os.path.abspath(pcap_file)), '.glimpse_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    # one cache per flow of the capture
+    path = os.path.join(cache_dir, f'{pcap_digest(pcap_file, cache_dir)}-'
+                        f'{flow_name(src_addr, dst_addr)}')
+    if os.path.exists(path + '.json'):
+        return SnapshotCache(path)
+    return SnapshotCache.write(
+        path, iter_pcap_frames(pcap_file, src_addr, dst_addr))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./tcp_partition4.pcap')
+    parser.add_argument('--src-ip', default='203.0.119.230')
+    parser.add_argument('--src-port', type=int, default=21804)
+    parser.add_argument('--dst-ip', default='10.31.38.4')
+    parser.add_argument('--dst-port', type=int, default=45793)
+    parser.add_argument('--cache-dir', default=None)
+    args = parser.parse_args()
+
+    cache = load(args.pcap_file, (args.src_ip, args.src_port),
+                 (args.dst_ip, args.dst_port), args.cache_dir)
+    print(f'{cache.path}: session {cache.session}, {len(cache)} messages, '
+          f'{cache.size} bytes')
@@ -0,0 +1,139 @@
+import argparse
+import socket
+import time
+import data_messages as dm
+import itch_SoupBinTCP_messages as im
+import numpy as np
+import columnar
+from itch_SoupBinTCP_decode import StreamDecoder
+from order_book import ADD_TYPES, OrderBook
+
+ADD_MTS = [mt[0] for mt in ADD_TYPES]
+
+
+class GlimpseClient:
+    '''
+        log in to a Glimpse server and load the snapshot into an OrderBook:
+        the runs of AddOrder messages in each block received are decoded
+        and added with numpy, the rest one by one; stops at the
+        EndOfSnapshot
+    '''
+    def __init__(self, ip, port, username=b'', password=b'', session=b'',
+                 seq=1, book=None, timeout=30.0, recv_size=1 << 20):
+        self.addr = (ip, port)
+        self.username = username
+        self.password = password
+        self.session = session
+        self.seq = seq
+        self.book = OrderBook() if book is None else book
+        self.timeout = timeout
+        self.recv_size = recv_size
+        self.messages = 0
+        self.elapsed = 0.0
+
+    def login_request(self):
+        return im.LoginRequestPktMsg.pack(
+            self.username.ljust(6)[:6], self.password.ljust(10)[:10],
+            self.session.ljust(10)[:10],
+            im.SoupBinTCPMsg.encode_seq_num(self.seq))
+
+    def load(self):
+        '''
+            return the sequence number of the snapshot (from the
+            EndOfSnapshot), raise ConnectionError if the session ends or the
+            login is rejected before it
+        '''
+        t0 = time.perf_counter()
+        with socket.create_connection(self.addr, self.timeout) as sock:
+            sock.sendall(self.login_request())
+            seq = self.receive(sock)
+            sock.sendall(im.LogoutRequestPktMsg.pack())
+        self.elapsed = max(time.perf_counter() - t0, 1e-9)
+        return seq
+
+    def receive(self, sock):
+        decoder = StreamDecoder()
+        while True:
+            data = sock.recv(self.recv_size)
+            if not data:
+                raise ConnectionError('connection closed before the end '
+                                      'of the snapshot')
+            seq = self.load_block(*decoder.feed_block(data))
+            if seq is not None:
+                return seq
+
+    def load_block(self, block, starts):
+        '''
+            apply complete frames; return the snapshot sequence number if
+            the EndOfSnapshot is among them
+        '''
+        if not len(starts):
+            return None
+        buf = np.frombuffer(block, dtype=np.uint8)
+        pts = buf[starts + 2]
+        # a control packet may be the last frame and have no byte 3
+        mts = buf[np.minimum(starts + 3, len(buf) - 1)]
+        adds = (pts == ord('S')) & np.isin(mts, ADD_MTS)
+        prev = 0
+        for i in np.flatnonzero(~adds).tolist() + [len(starts)]:
+            if i > prev:
+                self.add_run(buf, starts[prev:i], mts[prev:i])
+            prev = i + 1
+            if i == len(starts):
+                break
+            raw = block[starts[i]:starts[i + 1] if i + 1 < len(starts)
+                        else len(block)]
+            if pts[i] != ord('S'):
+                self.control(raw, raw[2:3])
+                continue
+            self.messages += 1
+            mt = raw[3:4]
+            d = dm.decode_msg(raw, mt, 3)
+            if mt == dm.EndOfSnapshotMsg.MT:
+                return im.SoupBinTCPMsg.decode_seq_num(d['Sequence Number'])
+            self.book.apply(d)
+        return None
+
+    def add_run(self, buf, starts, mts):
+        types = mts.tobytes()
+        tables = {mt: columnar.gather(buf, starts[mts == mt[0]] + 3, mt)
+                  for mt in ADD_TYPES if mt[0] in mts}
+        self.book.add_batch(columnar.Batch(types, tables))
+        self.messages += len(starts)
+
+    def control(self, raw, pt):
+        if pt == im.LoginAcceptedPktMsg.PT:
+            d, _ = im.decode(raw)
+            self.session = d['Session']
+        elif pt == im.LoginRejectedPktMsg.PT:
+            d, _ = im.decode(raw)
+            raise ConnectionError(
+                f'login rejected: {d["Reject Reason Code"]}')
+        elif pt == im.EndOfSessionPktMsg.PT:
+            raise ConnectionError('end of session before the end of the '
+                                  'snapshot')
+
+    def report(self):
+        print(f'{self.messages} messages in {self.elapsed:.3f}s: '
+              f'{self.messages / self.elapsed:.0f} msgs/s, '
+              f'{len(self.book)} orders')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ip', default='192.168.56.102',
+                        help='Glimpse server IP')
+    parser.add_argument('--port', type=int, default=21800,
+                        help='Glimpse server port')
+    parser.add_argument('--username', default='')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--session', default='')
+    parser.add_argument('--recv-size', type=int, default=1 << 20)
+    args = parser.parse_args()
+
+    client = GlimpseClient(args.ip, args.port, args.username.encode(),
+                           args.password.encode(), args.session.encode(),
+                           recv_size=args.recv_size)
+    seq = client.load()
+    print(f'snapshot of session {client.session} at seq {seq}')
+    client.report()
@@ -0,0 +1,169 @@
+import argparse
+import time
+import numpy as np
+import data_messages as dm
+import columnar
+import glimpse_cache
+
+
+def framed_dtype(msg_cls):
+    '''
+        dtype of a sequenced SoupBinTCP packet carrying one msg_cls message
+    '''
+    dt = columnar.struct_dtype(msg_cls)
+    return np.dtype({
+        'names': ['Packet Length', 'Packet Type'] + list(dt.names),
+        'formats': ['>u2', 'S1'] + [dt.fields[n][0] for n in dt.names]})
+
+
+def framed(msg_cls, n):
+    '''
+        n packets of msg_cls with the framing and the message type filled in
+    '''
+    packets = np.zeros(n, dtype=framed_dtype(msg_cls))
+    packets['Packet Length'] = 1 + msg_cls.STRUCT.size
+    packets['Packet Type'] = b'S'
+    packets[msg_cls.FIELDS[0]] = msg_cls.MT
+    return packets
+
+
+def block(packets):
+    return packets.tobytes(), np.full(len(packets), packets.itemsize)
+
+
+def alpha(fmt, values, width):
+    '''
+        space padded alphanumeric field
+    '''
+    return np.char.ljust(np.char.mod(fmt, values), width).astype(f'S{width}')
+
+
+def interleave(packets, mask):
+    '''
+        merge two packet arrays of different sizes into one block: the i-th
+        packet comes from packets[1] where mask[i], from packets[0] otherwise
+    '''
+    sizes = np.where(mask, packets[1].itemsize, packets[0].itemsize)
+    starts = np.cumsum(sizes) - sizes
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    for which, sel in ((packets[0], ~mask), (packets[1], mask)):
+        rows = which.view(np.uint8).reshape(len(which), which.itemsize)
+        out[starts[sel][:, None] + np.arange(which.itemsize)] = rows
+    return out.tobytes(), sizes
+
+
+def directory_blocks(book_ids, second, price_decimals):
+    n = len(book_ids)
+    seconds = framed(dm.SecondsMsg, 1)
+    seconds['Second'] = second
+    yield block(seconds)
+
+    books = framed(dm.OrderBookDirectoryMsg, n)
+    books['Order Book ID'] = book_ids
+    books['Symbol'] = alpha('SYN%d', book_ids, 32)
+    books['Long Name'] = alpha('SYNTHETIC BOOK %d', book_ids, 32)
+    books['ISIN'] = alpha('AU%010d', book_ids, 12)
+    books['Financial Product'] = 5
+    books['Trading Currency'] = b'AUD'
+    books['Number of decimals in Price'] = price_decimals
+    books['Odd Lot Size'] = 1
+    books['Round Lot Size'] = 1
+    books['Block Lot Size'] = 1
+    yield block(books)
+
+    ticks = framed(dm.TickSizeTableEntryMsg, n)
+    ticks['Order Book ID'] = book_ids
+    ticks['Tick Size'] = 1
+    yield block(ticks)
+
+    states = framed(dm.OrderBookStateMsg, n)
+    states['Order Book ID'] = book_ids
+    states['State Name'] = b'CONTINUOUS_TRADING'.ljust(20)
+    yield block(states)
+
+
+def order_block(book_ids, depth, orders_per_level, first_order_id, rng,
+                pid_ratio):
+    '''
+        full books for book_ids: depth price levels of orders_per_level
+        orders on each side, in book order (bids best first, then asks)
+        return (block, number of orders)
+    '''
+    # every order is a point of the (book, side, level, queue position) grid
+    shape = (len(book_ids), 2, depth, orders_per_level)
+    book, side, level, queue = (a.ravel() for a in np.indices(shape))
+    n = book.size
+    mid = rng.integers(depth + 10, 100 * (depth + 10), len(book_ids))
+    distance = level + 1
+    prices = np.where(side == 0, mid[book] - distance, mid[book] + distance)
+    pid = rng.random(n) < pid_ratio
+    orders = (framed(dm.AddOrderNoPIDMsg, (~pid).sum()),
+              framed(dm.AddOrderWithPIDMsg, pid.sum()))
+    for packets, sel in zip(orders, (~pid, pid)):
+        packets['Timestamp Nanoseconds'] = (
+            np.arange(n)[sel] + first_order_id) % 1000000000
+        packets['Order ID'] = np.arange(n)[sel] + first_order_id
+        packets['Order Book ID'] = book_ids[book[sel]]
+        packets['Side'] = np.where(side[sel] == 0, b'B', b'S')
+        packets['Order Book Position'] = (
+            level[sel] * orders_per_level + queue[sel] + 1)
+        packets['Quantity'] = rng.integers(1, 100, sel.sum()) * 100
+        packets['Price'] = prices[sel]
+        packets['Lot Type'] = 2
+    orders[1]['Participant ID'] = alpha(
+        'PART%03d', rng.integers(0, 1000, pid.sum()), 7)
+    return interleave(orders, pid), n
+
+
+def generate(path, books=1000, depth=10, orders_per_level=5,
+             first_book_id=1, next_seq=1, second=36000, price_decimals=2,
+             pid_ratio=0.5, books_per_block=1000, seed=0,
+             session=glimpse_cache.DEFAULT_SESSION):
+    '''
+        write a synthetic Glimpse snapshot as a glimpse_cache.SnapshotCache
+        at path: the directory, tick size and state of every book, then
+        every book full (depth levels a side, orders_per_level orders per
+        level), then the end of snapshot carrying next_seq
+    '''
+    rng = np.random.default_rng(seed)
+    book_ids = np.arange(first_book_id, first_book_id + books, dtype=np.uint32)
+
+    def blocks():
+        yield from directory_blocks(book_ids, second, price_decimals)
+        order_id = 1
+        for i in range(0, books, books_per_block):
+            orders, n = order_block(
+                book_ids[i:i + books_per_block], depth, orders_per_level,
+                order_id, rng, pid_ratio)
+            order_id += n
+            yield orders
+        end = framed(dm.EndOfSnapshotMsg, 1)
+        end['Sequence Number'] = str(next_seq).rjust(20).encode()
+        yield block(end)
+
+    return glimpse_cache.SnapshotCache.write_blocks(path, blocks(), session)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='snapshot cache to write, without '
+                        'extension; serve it with glimpse_server --snapshot')
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=10,
+                        help='price levels per side')
+    parser.add_argument('--orders-per-level', type=int, default=5)
+    parser.add_argument('--first-book-id', type=int, default=1)
+    parser.add_argument('--next-seq', type=int, default=1,
+                        help='MoldUDP64 sequence number the snapshot is at')
+    parser.add_argument('--pid-ratio', type=float, default=0.5,
+                        help='share of AddOrderWithPID among the orders')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    cache = generate(args.path, args.books, args.depth,
+                     args.orders_per_level, args.first_book_id,
+                     args.next_seq, pid_ratio=args.pid_ratio, seed=args.seed)
+    elapsed = max(time.perf_counter() - t0, 1e-9)
+    print(f'{cache.path}: {len(cache)} messages, {cache.size} bytes in '
+          f'{elapsed:.3f}s, {len(cache) / elapsed:.0f} msgs/s')
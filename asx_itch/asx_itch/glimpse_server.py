@@ -1,43 +1,139 @@
 import argparse
+import asyncio
 import socket
-import traceback
+import time
+import itch_SoupBinTCP_decode
 import itch_SoupBinTCP_messages as im
-import pcap_glimpse_extract
-
-
-def run(ip, port, buffer_size=1024):
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind((ip, port))
-    server.listen(1)
-    with server:
-        client_sock, address = server.accept()
-        print(f'Accepted connection from {address[0]}:{address[1]}')
-        it = pcap_glimpse_extract.iter_msgs()
-        print(next(it))  # skip the login request
-        # for d, raw_msg, ip_src, ip_dst in iter_msgs():
-        #     print(f'(src, dst): ({ip_src}, {ip_dst}); decode: {d}')
-        #     print('-' * 20)
-        sent = False
-        with client_sock as s:
-            try:
-                while True:
-                    data = s.recv(buffer_size)
-                    if data:
-                        d = im.decode(data)
-                        print('<<', data)
-                        print('decode:', d)
-                        if not sent:
-                            sent = True
-                            for d, raw_msg, *_ in it:
-                                print('>>', raw_msg)
-                                print('decode', d)
-                                s.send(raw_msg)
-                            break
-                        print('-' * 20)
-            except Exception as e:
-                print(e)
-                print(traceback.print_exc())
+import glimpse_cache
+
+SEND_MODES = ('sendfile', 'write')
+
+
+class GlimpseServer:
+    '''
+        SoupBinTCP server replaying one snapshot (glimpse_cache.SnapshotCache)
+        to any number of concurrent sessions, each from the sequence number
+        it asked for
+        send_mode: 'sendfile' (zero copy from the cache file) or 'write'
+        (slices of batch_size bytes of the memory mapped cache)
+    '''
+    def __init__(self, cache, heartbeat=1.0, send_mode='sendfile',
+                 batch_size=1 << 20, sndbuf=None, verbose=False):
+        self.cache = cache
+        self.session = cache.session.ljust(10)[:10]
+        self.heartbeat = heartbeat
+        self.send_mode = send_mode
+        self.batch_size = batch_size
+        self.sndbuf = sndbuf
+        self.verbose = verbose
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        print(f'Accepted connection from {peer[0]}:{peer[1]}')
+        if self.sndbuf:
+            writer.get_extra_info('socket').setsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        decoder = itch_SoupBinTCP_decode.StreamDecoder()
+        sender = None
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for d, raw_msg in decoder.feed(data):
+                    if self.verbose:
+                        print('<<', peer, d)
+                    pt = raw_msg[2:3]
+                    if pt == im.LoginRequestPktMsg.PT and sender is None:
+                        sender = self.login(d, writer)
+                        if sender is None:
+                            await writer.drain()
+                            return
+                    elif pt == im.LogoutRequestPktMsg.PT:
+                        return
+        except (ConnectionError, ValueError) as e:
+            print(peer, e)
+        finally:
+            if sender is not None:
+                sender.cancel()
+            writer.close()
+            print(f'Closed connection from {peer[0]}:{peer[1]}')
+
+    def login(self, d, writer):
+        '''
+            answer a login request, return the task streaming the snapshot
+            (None when rejected)
+        '''
+        session = d['Requested Session'].strip(b' ')
+        if session and session != self.session.strip(b' '):
+            # S: requested session not available
+            writer.write(im.LoginRejectedPktMsg.pack(b'S'))
+            return None
+        seq = max(im.SoupBinTCPMsg.decode_seq_num(
+            d['Requested Sequence Number']), 1)
+        writer.write(im.LoginAcceptedPktMsg.pack(
+            self.session, im.SoupBinTCPMsg.encode_seq_num(seq)))
+        return asyncio.ensure_future(self.stream(writer, seq))
+
+    async def send_snapshot(self, writer, seq):
+        '''
+            send the snapshot from seq on in as few and as large writes as
+            possible; partial sends are left to the transport
+        '''
+        offset, count = self.cache.span(seq)
+        if not count:
+            return
+        if self.send_mode == 'sendfile':
+            with open(self.cache.stream_file, 'rb') as f:
+                await asyncio.get_running_loop().sendfile(
+                    writer.transport, f, offset, count)
+        else:
+            view = self.cache.view(seq)
+            for i in range(0, count, self.batch_size):
+                writer.write(view[i:i + self.batch_size])
+                await writer.drain()
+
+    async def stream(self, writer, seq):
+        '''
+            send the snapshot from seq on, report the throughput, then send
+            heartbeats
+        '''
+        peer = writer.get_extra_info('peername')
+        try:
+            t0 = time.perf_counter()
+            await self.send_snapshot(writer, seq)
+            elapsed = max(time.perf_counter() - t0, 1e-9)
+            _, count = self.cache.span(seq)
+            n_msgs = max(len(self.cache) - seq + 1, 0)
+            print(f'{peer[0]}:{peer[1]} sent {n_msgs} messages from seq '
+                  f'{seq}, {count} bytes in {elapsed:.3f}s: '
+                  f'{count / elapsed / 1e6:.1f} MB/s, '
+                  f'{n_msgs / elapsed:.0f} msgs/s')
+            while True:
+                await asyncio.sleep(self.heartbeat)
+                writer.write(im.ServerHeartBeatPktMsg.pack())
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def serve(self, ip, port):
+        server = await asyncio.start_server(self.handle, ip, port)
+        async with server:
+            await server.serve_forever()
+
+
+def run(ip, port, pcap_file='./tcp_partition4.pcap', cache_dir=None,
+        verbose=False, snapshot=None, **server_kwargs):
+    '''
+        serve the snapshot of pcap_file, or the prebuilt snapshot cache at
+        snapshot (e.g. from glimpse_gen) when given
+    '''
+    cache = glimpse_cache.SnapshotCache(snapshot) if snapshot else \
+        glimpse_cache.load(pcap_file, cache_dir=cache_dir)
+    print(f'{len(cache)} messages in the snapshot of session '
+          f'{cache.session}')
+    asyncio.run(GlimpseServer(cache, verbose=verbose, **server_kwargs).serve(
+        ip, port))
 
 
 if __name__ == '__main__':
@@ -46,5 +142,22 @@ if __name__ == '__main__':
                         help='TCP IP to send data to (TCP server IP)')
     parser.add_argument('--port', type=int, default=21800,
                         help='TCP port to send data to (TCP server port)')
+    parser.add_argument('--pcap-file', default='./tcp_partition4.pcap')
+    parser.add_argument('--cache-dir', default=None,
+                        help='where the pre-framed snapshots are kept; '
+                        'next to the pcap if unspecified')
+    parser.add_argument('--snapshot', default=None,
+                        help='serve this snapshot cache (path without '
+                        'extension) instead of the pcap')
+    parser.add_argument('--send-mode', choices=SEND_MODES,
+                        default='sendfile')
+    parser.add_argument('--batch-size', type=int, default=1 << 20,
+                        help='bytes per write in the write send mode')
+    parser.add_argument('--sndbuf', type=int, default=None,
+                        help='SO_SNDBUF of the client sockets')
+    parser.add_argument('--verbose', action='store_true',
+                        help='print the packets received from clients')
     args = parser.parse_args()
-    run(args.ip, args.port)
+    run(args.ip, args.port, args.pcap_file, args.cache_dir, args.verbose,
+        args.snapshot, send_mode=args.send_mode, batch_size=args.batch_size,
+        sndbuf=args.sndbuf)
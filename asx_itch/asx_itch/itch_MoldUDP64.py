@@ -19,6 +19,7 @@ class Header:
 
 MSG_BLOCK = struct.Struct('!H')
 MSG_BLOCK_MT = struct.Struct('!Hc')
+END_OF_SESSION = 0xffff
 
 
 def decode_header(raw):
@@ -26,34 +27,91 @@ def decode_header(raw):
     return d
 
 
-def decode_block(raw, offset=0):
+def decode_block(raw, offset=0, errors=None, intern=None, projection=None):
     '''
         decode one block (length + message)
         return (dict, the offset after decoding)
+        with errors (data_messages.DecodeErrors), a bad block is counted
+        there and returned as (None, the offset after it) instead of raising
     '''
+    if errors is not None and offset + MSG_BLOCK_MT.size > len(raw):
+        errors.record('short block', offset, len(raw) - offset)
+        return None, len(raw)
     block_head = MSG_BLOCK_MT.unpack_from(raw, offset)
     block_len, msg_type = block_head
     offset += 2
     if block_len <= 0:
-        raise ValueError('block len error')
-    d = dm.decode_msg(raw, msg_type, offset)
+        if errors is None:
+            raise ValueError('block len error')
+        errors.record('bad length', offset - 2, block_len)
+        return None, offset
+    if errors is not None and offset + block_len > len(raw):
+        errors.record('bad length', offset - 2, (msg_type, block_len))
+        return None, len(raw)
+    d = dm.decode_msg(raw, msg_type, offset, errors, block_len, intern,
+                      projection)
     return d, offset + block_len
 
 
-def decode_iter_block(raw, offset=20, num_msgs=0):
+def iter_msg_offsets(raw):
+    '''
+        (offset, length) of each message of a packet, without decoding
+    '''
+    count = decode_header(raw)[-1]
+    if count == END_OF_SESSION:
+        return
+    offset = Header.STRUCT.size
+    for _ in range(count):
+        if offset + MSG_BLOCK.size > len(raw):
+            return
+        block_len, = MSG_BLOCK.unpack_from(raw, offset)
+        yield offset + MSG_BLOCK.size, block_len
+        offset += MSG_BLOCK.size + block_len
+
+
+def decode_iter_block(raw, offset=20, num_msgs=0, errors=None,
+                      intern=None, projection=None):
     for _ in range(num_msgs):
-        d, offset = decode_block(raw, offset)
-        yield d
+        if errors is not None and offset >= len(raw):
+            errors.record('short block', offset, 'past end of packet')
+            return
+        d, offset = decode_block(raw, offset, errors, intern, projection)
+        if d is not None:
+            yield d
 
 
-def decode(raw, with_header=False):
+def decode(raw, with_header=False, errors=None, clock=None, intern=None,
+           projection=None, skip=0):
+    '''
+        with clock (data_messages.Clock), messages get their absolute time
+        as 'Timestamp', tracked per session; with intern
+        (data_messages.InternTable, the one of the packet's session), the
+        alphanumeric fields come as codes; with projection
+        (data_messages.compile_projection), only the fields kept are
+        decoded; the first skip blocks are stepped over by their length,
+        not decoded
+    '''
+    if errors is not None and len(raw) < Header.STRUCT.size:
+        errors.record('short block', 0, 'packet shorter than header')
+        return
     head = decode_header(raw)
     if with_header:
         yield dict(zip(Header.FIELDS, head))
     num_msgs = head[-1]
+    if num_msgs == END_OF_SESSION:
+        num_msgs = 0
     if not num_msgs:
         yield {}
-    for block in decode_iter_block(raw, num_msgs=num_msgs):
+    skip = min(skip, num_msgs)
+    offset = Header.STRUCT.size
+    for _ in range(skip):
+        if offset + MSG_BLOCK.size > len(raw):
+            break
+        offset += MSG_BLOCK.size + MSG_BLOCK.unpack_from(raw, offset)[0]
+    for block in decode_iter_block(raw, offset, num_msgs - skip, errors,
+                                   intern, projection):
+        if clock is not None:
+            clock.stamp(block, head[0])
         yield block
 
 
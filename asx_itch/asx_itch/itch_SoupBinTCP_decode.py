@@ -1,3 +1,5 @@
+import numpy as np
+import data_messages as dm
 import itch_SoupBinTCP_messages as im
 
 
@@ -18,3 +20,112 @@ def decode(raw):
     '''
     for d, msg_len in decode_iter_msg(raw):
         yield d, msg_len
+
+
+class StreamDecoder:
+    '''
+        push style decoder for a SoupBinTCP byte stream (a TCP flow, a pcap
+        flow, a client socket): feed() the bytes as they come, get back the
+        complete messages; a partial trailing frame is kept for the next
+        feed. consumed is the stream offset right after the last frame
+        returned. With errors (data_messages.DecodeErrors), bad messages
+        are counted and skipped instead of raising. feed() stamps the
+        sequenced messages with their absolute time (data_messages.Clock).
+        With intern (data_messages.InternTable), the alphanumeric fields of
+        the messages come as codes; with projection
+        (data_messages.compile_projection), only the fields kept are decoded.
+    '''
+    def __init__(self, errors=None, intern=None, projection=None):
+        self.errors = errors
+        self.intern = intern
+        self.projection = projection
+        self.clock = dm.Clock()
+        self.buf = bytearray()
+        self.pos = 0
+        self.consumed = 0
+
+    def __len__(self):
+        '''
+            bytes received but not returned as a frame yet
+        '''
+        return len(self.buf) - self.pos
+
+    def pending(self):
+        return bytes(self.buf[self.pos:])
+
+    def reset(self):
+        '''
+            drop the buffered bytes, e.g. after a decode error
+        '''
+        self.consumed += len(self)
+        self.buf.clear()
+        self.pos = 0
+
+    def _append(self, data):
+        # compact once at least half the buffer has been returned already,
+        # so every byte gets moved at most once on average
+        if self.pos and self.pos * 2 >= len(self.buf):
+            del self.buf[:self.pos]
+            self.pos = 0
+        self.buf += data
+
+    def feed_frames(self, data=b''):
+        '''
+            append data and iterate the complete frames (length field
+            included) as bytes
+        '''
+        self._append(data)
+        return self._iter_frames()
+
+    def _iter_frames(self):
+        buf = self.buf
+        while True:
+            pos = self.pos
+            if pos + 2 > len(buf):
+                return
+            end = pos + 2 + int.from_bytes(buf[pos:pos + 2], 'big')
+            if end > len(buf):
+                return
+            self.pos = end
+            self.consumed += end - pos
+            yield bytes(buf[pos:end])
+
+    def feed_block(self, data=b''):
+        '''
+            append data and return (bytes, frame start offsets in them) for
+            all the complete frames at once, without a copy per frame
+        '''
+        self._append(data)
+        buf = self.buf
+        start = pos = self.pos
+        n = len(buf)
+        starts = []
+        while pos + 2 <= n:
+            end = pos + 2 + (buf[pos] << 8 | buf[pos + 1])
+            if end > n:
+                break
+            starts.append(pos)
+            pos = end
+        self.pos = pos
+        self.consumed += pos - start
+        return bytes(buf[start:pos]), np.array(starts, dtype=np.int64) - start
+
+    def feed(self, data=b''):
+        '''
+            append data and iterate (dict, raw message) for the complete
+            messages, decoded as itch_SoupBinTCP_messages.decode does
+        '''
+        self._append(data)
+        return self._iter_msgs()
+
+    def _iter_msgs(self):
+        errors = self.errors
+        intern = self.intern
+        projection = self.projection
+        for raw in self._iter_frames():
+            d, _ = im.decode(raw, 0, errors, intern, projection)
+            if d is None:
+                continue
+            if 'decode' in d:
+                self.clock.stamp(d['decode'])
+            yield d, raw
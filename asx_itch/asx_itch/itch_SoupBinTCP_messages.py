@@ -3,6 +3,7 @@ import data_messages as dm
 
 
 MSG_BLOCK = struct.Struct('!Hc')
+MSG_LEN = struct.Struct('!H')
 
 
 class SoupBinTCPMsg:
@@ -13,16 +14,51 @@ class SoupBinTCPMsg:
 
     @staticmethod
     def decode_seq_num(raw):
-        raw = raw.lstrip(b' ')
-        return int.from_bytes(raw, byteorder='big')
+        '''
+            sequence numbers are ASCII, right justified and space padded
+        '''
+        raw = raw.strip(b' ')
+        return int(raw) if raw else 0
+
+    @staticmethod
+    def encode_seq_num(seq_num):
+        return str(seq_num).rjust(20).encode()
+
+    @classmethod
+    def pack(cls, *args):
+        '''
+            packet with its length field, packet type included
+        '''
+        body = cls.STRUCT.pack(cls.PT, *args)
+        return MSG_LEN.pack(len(body)) + body
 
 
 class ServerHeartBeatPktMsg(SoupBinTCPMsg):
+    PT = b'H'
+    STRUCT = struct.Struct('!c')
+    FIELDS = ['Packet Type']
+
+
+class ClientHeartBeatPktMsg(SoupBinTCPMsg):
+    PT = b'R'
+    STRUCT = struct.Struct('!c')
+    FIELDS = ['Packet Type']
+
+
+class EndOfSessionPktMsg(SoupBinTCPMsg):
+    PT = b'Z'
+    STRUCT = struct.Struct('!c')
+    FIELDS = ['Packet Type']
+
+
+class LogoutRequestPktMsg(SoupBinTCPMsg):
+    PT = b'O'
     STRUCT = struct.Struct('!c')
     FIELDS = ['Packet Type']
 
 
 class LoginRequestPktMsg(SoupBinTCPMsg):
+    PT = b'L'
     STRUCT = struct.Struct('!c6s10s10s20s')
     FIELDS = [
         'Packet Type',
@@ -33,28 +69,48 @@ class LoginRequestPktMsg(SoupBinTCPMsg):
 
 
 class LoginAcceptedPktMsg(SoupBinTCPMsg):
+    PT = b'A'
     STRUCT = struct.Struct('!c10s20s')
     FIELDS = ['Packet Type', 'Session', 'Sequence Number']
 
 
-MSG_TYPE_STRUCT_MAP = {
-    b'H': ServerHeartBeatPktMsg,
-    b'A': LoginAcceptedPktMsg,
-    b'L': LoginRequestPktMsg}
+class LoginRejectedPktMsg(SoupBinTCPMsg):
+    PT = b'J'
+    STRUCT = struct.Struct('!cc')
+    FIELDS = ['Packet Type', 'Reject Reason Code']
+
+
+MSG_TYPE_STRUCT_MAP = {msg_cls.PT: msg_cls
+                       for msg_cls in SoupBinTCPMsg.__subclasses__()}
+
+
+def pack_sequenced(raw_msg):
+    '''
+        sequenced data packet around one ITCH message
+    '''
+    return MSG_BLOCK.pack(len(raw_msg) + 1, b'S') + raw_msg
 
 
-def decode(raw, offset=0):
+def decode(raw, offset=0, errors=None, intern=None, projection=None):
     '''
         decode one message
         return (dict, the message len including the header packet length)
+        with errors (data_messages.DecodeErrors), a bad message is counted
+        there and returned as (None, its len) instead of raising; with
+        intern (data_messages.InternTable), alphanumeric fields come as codes;
+        with projection (data_messages.compile_projection), only the fields
+        kept are decoded
     '''
+    if errors is not None and raw[offset:offset + 2] == b'\x00\x00':
+        errors.record('bad length', offset, 0)
+        return None, 2
     block_len, msg_type = MSG_BLOCK.unpack_from(raw, offset)
     offset += 2
     if block_len <= 0:
         raise ValueError(
             'block len error: ',
             'raw',
-            raw,
+            raw[offset - 2:offset + 1],
             'block len',
             block_len,
             'msg type',
@@ -67,7 +123,11 @@ def decode(raw, offset=0):
                 'remain': raw[offset:offset+block_len]}, -1
     if msg_type == b'S':
         data_msg_type = raw[offset + 1:offset+2]
-        d_decoded = dm.decode_msg(raw, data_msg_type, offset+1)
+        d_decoded = dm.decode_msg(raw, data_msg_type, offset+1,
+                                  errors, block_len - 1, intern,
+                                  projection)
+        if d_decoded is None:
+            return None, block_len + 2
         return {'Message Type:': b'S', 'len': block_len,
                 'decode': d_decoded}, block_len + 2
     elif msg_type in MSG_TYPE_STRUCT_MAP:
@@ -79,9 +139,15 @@ def decode(raw, offset=0):
                     d[k] = xform(d[k])
             return d, block_len + 2
         except struct.error as e:
+            if errors is not None:
+                errors.record('bad length', offset, (msg_type, block_len))
+                return None, block_len + 2
             raise Exception(
-                'raw:', raw[offset:],
-                ', raw len', len(raw[offset:])) from e
+                'raw:', raw[offset:offset + block_len],
+                ', raw len', len(raw) - offset) from e
+    elif errors is not None:
+        errors.record('unknown type', offset, msg_type)
+        return None, block_len + 2
     else:
         return {'unknown': '', 'offset': offset, 'block_len': block_len,
                 'msg_type': msg_type, 'raw_len': len(raw),
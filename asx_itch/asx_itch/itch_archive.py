@@ -0,0 +1,260 @@
+import argparse
+import functools
+import json
+import lzma
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pcap_index
+import pcap_reader
+
+# name: (compress(data, level), decompress(data)); zlib and lzma release
+# the GIL, so blocks decompress in parallel on threads
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, level),
+             zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level),
+             lzma.decompress),
+    'none': (lambda data, level: data, bytes),
+}
+
+BLOCK_DTYPE = np.dtype([
+    ('offset', '<u8'),      # of the compressed block in the archive
+    ('length', '<u8'),      # compressed
+    ('raw_length', '<u8'),
+    ('packets', '<u4'),
+    ('capture_ts', '<f8'),  # of the first packet
+    ('last_ts', '<f8'),
+    ('seq', '<u8'),         # sequence number of the first message
+    ('second', '<u4'),      # last ITCH SecondsMsg before the block
+    ('skip', '<u2')])       # bytes ending a SoupBinTCP frame from before
+
+
+def pack_block(ts, payloads):
+    '''
+        packet count, payload lengths, capture timestamps, then payloads
+    '''
+    head = np.array([len(payloads)], dtype='<u4').tobytes()
+    lens = np.array([len(p) for p in payloads], dtype='<u4').tobytes()
+    return b''.join([head, lens, np.array(ts, dtype='<f8').tobytes()] +
+                    payloads)
+
+
+def unpack_block(raw):
+    '''
+        (capture timestamps, payloads) of a block
+    '''
+    n = int(np.frombuffer(raw, dtype='<u4', count=1)[0])
+    lens = np.frombuffer(raw, dtype='<u4', count=n, offset=4)
+    ts = np.frombuffer(raw, dtype='<f8', count=n, offset=4 + 4 * n)
+    head = 4 + 12 * n
+    ends = (head + np.cumsum(lens, dtype=np.int64)).tolist()
+    starts = [head] + ends[:-1]
+    return ts, [raw[s:e] for s, e in zip(starts, ends)]
+
+
+def archive_paths(path):
+    return path, f'{path}.idx.npy', f'{path}.json'
+
+
+def write(path, payloads, proto='tcp', codec='zlib', level=6,
+          block_size=1 << 20):
+    '''
+        archive (_, capture ts, payload) of one SoupBinTCP or MoldUDP64 flow
+        in independently compressed blocks of about block_size payload
+        bytes, each starting at a packet where a message (frame) starts;
+        the block index and a json description sit next to it, written last
+        return the block index
+    '''
+    compress = functools.partial(CODECS[codec][0], level=level)
+    packets = []
+    total = [0]
+
+    def pulled():
+        for i, (_, ts, payload) in enumerate(payloads):
+            packets.append((ts, payload))
+            total[0] += len(payload)
+            yield i, ts, payload
+
+    if proto == 'tcp':
+        entries = pcap_index._iter_soup_entries(pulled(), 1)
+    else:
+        entries = pcap_index._iter_mold_entries(pulled(), 1)
+    blocks = []
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        def flush(packets, start):
+            ts = [t for t, _ in packets]
+            raw = pack_block(ts, [p for _, p in packets])
+            data = compress(raw)
+            blocks.append((f.tell(), len(data), len(raw), len(packets),
+                           ts[0], ts[-1]) + start)
+            f.write(data)
+
+        # an entry comes while its packet is the last one pulled
+        start = None
+        begin = 0
+        for _, _, seq, second, skip in entries:
+            before = total[0] - len(packets[-1][1])
+            if start is None:
+                # packets before the first frame start cannot be decoded
+                del packets[:-1]
+            elif before - begin >= block_size:
+                flush(packets[:-1], start)
+                del packets[:-1]
+            else:
+                continue
+            start = (seq, second, skip)
+            begin = before
+        if start is not None and packets:
+            flush(packets, start)
+    index = np.array(blocks, dtype=BLOCK_DTYPE)
+    data_path, index_path, meta_path = archive_paths(path)
+    os.replace(tmp, data_path)
+    np.save(index_path, index)
+    with open(f'{meta_path}.tmp', 'w') as f:
+        json.dump({'proto': proto, 'codec': codec, 'level': level,
+                   'block_size': block_size, 'blocks': len(index),
+                   'packets': int(index['packets'].sum()),
+                   'raw_bytes': int(index['raw_length'].sum())}, f)
+    os.replace(f'{meta_path}.tmp', meta_path)
+    return index
+
+
+class Archive:
+    '''
+        random access reader of a compressed block archive (write()): the
+        block index is searched by capture time, sequence number or ITCH
+        second, and blocks are decompressed ahead by a pool of threads
+    '''
+    def __init__(self, path, workers=None):
+        data_path, index_path, meta_path = archive_paths(path)
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.proto = self.meta['proto']
+        self.decompress = CODECS[self.meta['codec']][1]
+        self.index = np.load(index_path, mmap_mode='r')
+        self.path = data_path
+        self.workers = workers or os.cpu_count()
+
+    def __len__(self):
+        return len(self.index)
+
+    def find(self, capture_ts=None, seq=None, second=None):
+        '''
+            the last block at or before the given capture time, sequence
+            number or ITCH second (exactly one of them)
+        '''
+        (key, value), = [(k, v) for k, v in (
+            ('capture_ts', capture_ts), ('seq', seq), ('second', second))
+            if v is not None]
+        pos = np.searchsorted(self.index[key], value, side='right')
+        return max(int(pos) - 1, 0)
+
+    def read_block(self, i, f=None):
+        '''
+            (capture timestamps, payloads) of block i
+        '''
+        entry = self.index[i]
+        if f is None:
+            with open(self.path, 'rb') as f:
+                return self.read_block(i, f)
+        data = os.pread(f.fileno(), int(entry['length']),
+                        int(entry['offset']))
+        return unpack_block(self.decompress(data))
+
+    def iter_blocks(self, start=0, stop=None):
+        '''
+            yield (capture timestamps, payloads) of blocks [start, stop), in
+            order, decompressed workers at a time
+        '''
+        stop = len(self) if stop is None else min(stop, len(self))
+        with open(self.path, 'rb') as f, \
+                ThreadPoolExecutor(max_workers=self.workers) as pool:
+            window = 2 * self.workers
+            futures = [pool.submit(self.read_block, i, f)
+                       for i in range(start, min(start + window, stop))]
+            for i in range(start, stop):
+                if i + window < stop:
+                    futures.append(pool.submit(self.read_block, i + window, f))
+                yield futures[i - start].result()
+                futures[i - start] = None
+
+    def iter_payloads(self, start=0, stop=None):
+        '''
+            (block, capture ts, payload) like pcap_reader.iter_payloads
+        '''
+        for i, (ts, payloads) in enumerate(self.iter_blocks(start, stop),
+                                           start):
+            for t, payload in zip(ts.tolist(), payloads):
+                yield i, t, payload
+
+    def iter_from(self, block=0):
+        '''
+            decode from a block on, as pcap_index.iter_from: yield (capture
+            ts, sequence number, ITCH second, message dict)
+        '''
+        return pcap_index.decode_payloads(
+            self.iter_payloads(block), self.index[block], self.proto)
+
+    def iter_window(self, capture_ts=None, seq=None, until=None):
+        '''
+            seek by capture time or sequence number, then decode up to (not
+            including) until, in the same unit
+        '''
+        key = 0 if capture_ts is not None else 1
+        start = capture_ts if capture_ts is not None else seq
+        for rec in self.iter_from(self.find(capture_ts=capture_ts, seq=seq)):
+            if rec[key] < start:
+                continue
+            if until is not None and rec[key] >= until:
+                return
+            yield rec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=('pack', 'info', 'cat'))
+    parser.add_argument('archive')
+    parser.add_argument('--pcap-file', default='./tcp_partition4.pcap')
+    parser.add_argument('--proto', choices=pcap_index.PROTOS, default='tcp')
+    parser.add_argument('--src-ip', default=None)
+    parser.add_argument('--src-port', type=int, default=None)
+    parser.add_argument('--dst-ip', default=None)
+    parser.add_argument('--dst-port', type=int, default=None)
+    parser.add_argument('--codec', choices=CODECS, default='zlib')
+    parser.add_argument('--level', type=int, default=6)
+    parser.add_argument('--block-size', type=int, default=1 << 20)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--from-ts', type=float, default=None)
+    parser.add_argument('--from-seq', type=int, default=None)
+    parser.add_argument('--until', type=float, default=None)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.command == 'pack':
+        src_addr = None if args.src_ip is None else (args.src_ip,
+                                                     args.src_port)
+        dst_addr = None if args.dst_ip is None else (args.dst_ip,
+                                                     args.dst_port)
+        write(args.archive, pcap_reader.iter_payloads(
+            args.pcap_file, pcap_index.PROTOS[args.proto], src_addr,
+            dst_addr), args.proto, args.codec, args.level, args.block_size)
+    archive = Archive(args.archive, args.workers)
+    if args.command == 'cat':
+        if args.from_ts is None and args.from_seq is None:
+            msgs = archive.iter_from()
+        else:
+            msgs = archive.iter_window(args.from_ts, args.from_seq,
+                                       args.until)
+        for ts, seq, second, d in msgs:
+            print(f'{ts:.6f} {seq} {second}: {d}')
+    else:
+        size = os.path.getsize(archive.path)
+        raw = archive.meta['raw_bytes']
+        print(f'{len(archive)} blocks ({archive.meta["codec"]}), '
+              f'{archive.meta["packets"]} packets, {raw} bytes in {size} '
+              f'({raw / max(size, 1):.1f}x) in '
+              f'{time.perf_counter() - t0:.3f}s')
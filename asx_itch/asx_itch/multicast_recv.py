@@ -1,12 +1,16 @@
 import socket
 import struct
 import argparse
+import time
 import itch_MoldUDP64
 import traceback
 from collections import defaultdict
 
 
-def run(groups, port, iface=None, bind_group=None):
+def join(groups, port, iface=None, bind_group=None):
+    '''
+        UDP socket bound to port (and bind_group) that joined groups
+    '''
     # generally speaking you want to bind to one of the groups you joined in
     # this script,
     # but it is also possible to bind to group which is added by some other
@@ -28,7 +32,44 @@ def run(groups, port, iface=None, bind_group=None):
             socket.INADDR_ANY if iface is None else socket.inet_aton(iface))
 
         sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    return sock
 
+
+def record(sock, directory, fmt='npy', batch_size=1 << 16):
+    '''
+        write the messages received to columnar files (columnar_export)
+        until interrupted
+    '''
+    from columnar import BatchBuilder
+    from columnar_export import ColumnarWriter
+    builder = BatchBuilder()
+    with ColumnarWriter(directory, fmt) as writer:
+        try:
+            while True:
+                raw = sock.recv(10240)
+                ts = time.time()
+                if len(raw) < itch_MoldUDP64.Header.STRUCT.size:
+                    continue
+                count = itch_MoldUDP64.decode_header(raw)[-1]
+                if count == itch_MoldUDP64.END_OF_SESSION:
+                    continue
+                for offset, length in itch_MoldUDP64.iter_msg_offsets(raw):
+                    if offset + length > len(raw):
+                        break
+                    if length:
+                        builder.append(raw[offset:offset + length], ts)
+                if len(builder) >= batch_size:
+                    writer.write(builder.build())
+                    builder = BatchBuilder()
+        except KeyboardInterrupt:
+            writer.write(builder.build())
+
+
+def run(groups, port, iface=None, bind_group=None, export=None,
+        export_format='npy'):
+    sock = join(groups, port, iface, bind_group)
+    if export:
+        return record(sock, export, export_format)
     while True:
         try:
             raw = sock.recv(10240)
@@ -57,5 +98,11 @@ if __name__ == '__main__':
         'in the interface specified by --iface. '
         'If unspecified, bind to 0.0.0.0 '
         '(all addresses (all multicast addresses) of that interface)')
+    parser.add_argument('--export', default=None,
+                        help='directory to write columnar files to, '
+                        'instead of printing')
+    parser.add_argument('--export-format', default='npy',
+                        choices=('npy', 'npz', 'parquet', 'varint'))
     args = parser.parse_args()
-    run(args.join_mcast_groups, args.port, args.iface, args.bind_group)
+    run(args.join_mcast_groups, args.port, args.iface, args.bind_group,
+        args.export, args.export_format)
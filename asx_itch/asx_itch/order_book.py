@@ -0,0 +1,205 @@
+import numpy as np
+
+SIDES = {b'B': 0, b'S': 1}
+ADD_TYPES = (b'A', b'F')
+ORDER_DTYPE = np.dtype([
+    ('order_id', np.uint64),
+    ('book', np.uint32),
+    ('side', np.uint8),
+    ('price', np.int32),
+    ('quantity', np.uint64),
+    ('priority', np.uint64)])
+
+
+class OrderBook:
+    '''
+        the resting orders of every order book of a feed, one numpy column
+        per attribute; an order lives in a slot found through
+        (Order Book ID, side, Order ID), and freed slots are reused.
+        priority is a running counter: lower is earlier in the queue
+    '''
+    COLUMNS = ORDER_DTYPE.names
+
+    def __init__(self, capacity=1 << 16):
+        for name in self.COLUMNS:
+            setattr(self, name,
+                    np.zeros(capacity, dtype=ORDER_DTYPE[name]))
+        self.slots = {}
+        self.free = []
+        self.used = 0
+        self.next_priority = 0
+        self.states = {}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self, need):
+        capacity = len(self.order_id)
+        if need <= capacity:
+            return
+        capacity = max(capacity * 2, need)
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def _slot(self):
+        if self.free:
+            return self.free.pop()
+        self._grow(self.used + 1)
+        self.used += 1
+        return self.used - 1
+
+    def add(self, book, side, order_id, price, quantity):
+        key = (book, SIDES[side], order_id)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = self._slot()
+        self.order_id[slot] = order_id
+        self.book[slot] = book
+        self.side[slot] = key[1]
+        self.price[slot] = price
+        self.quantity[slot] = quantity
+        self.priority[slot] = self.next_priority
+        self.next_priority += 1
+
+    def add_batch(self, batch):
+        '''
+            add the AddOrder rows of a columnar.Batch at once, queued in
+            the order they arrived
+        '''
+        types = np.frombuffer(batch.types, dtype='S1')
+        for mt in ADD_TYPES:
+            table = batch.tables.get(mt)
+            if table is None or not len(table):
+                continue
+            sides = (table['Side'] == b'S').astype(np.uint8)
+            keys = list(zip(table['Order Book ID'].tolist(), sides.tolist(),
+                            table['Order ID'].tolist()))
+            for key in self.slots.keys() & keys:
+                self.remove(*key)
+            n = len(keys)
+            slots = np.empty(n, dtype=np.int64)
+            reused = min(len(self.free), n)
+            if reused:
+                slots[:reused] = self.free[-reused:]
+                del self.free[-reused:]
+            self._grow(self.used + n - reused)
+            slots[reused:] = np.arange(self.used, self.used + n - reused)
+            self.used += n - reused
+            self.slots.update(zip(keys, slots.tolist()))
+            self.order_id[slots] = table['Order ID']
+            self.book[slots] = table['Order Book ID']
+            self.side[slots] = sides
+            self.price[slots] = table['Price']
+            self.quantity[slots] = table['Quantity']
+            self.priority[slots] = (
+                self.next_priority + np.flatnonzero(types == mt))
+        self.next_priority += len(types)
+
+    def remove(self, book, side, order_id):
+        '''
+            side as 0 (bid) or 1 (ask); return the freed slot or None
+        '''
+        slot = self.slots.pop((book, side, order_id), None)
+        if slot is not None:
+            self.quantity[slot] = 0
+            self.free.append(slot)
+        return slot
+
+    def delete(self, book, side, order_id):
+        self.remove(book, SIDES[side], order_id)
+
+    def execute(self, book, side, order_id, quantity):
+        '''
+            take quantity off a resting order
+            return its price, or None for an unknown order
+        '''
+        key = (book, SIDES[side], order_id)
+        slot = self.slots.get(key)
+        if slot is None:
+            return None
+        price = int(self.price[slot])
+        left = int(self.quantity[slot]) - quantity
+        if left > 0:
+            self.quantity[slot] = left
+        else:
+            self.remove(*key)
+        return price
+
+    def replace(self, book, side, order_id, price, quantity):
+        '''
+            new price and quantity; the order loses its queue priority
+        '''
+        self.add(book, side, order_id, price, quantity)
+
+    def apply(self, d):
+        '''
+            update from one message dict (data_messages.decode_msg)
+        '''
+        mt = d.get('Message Type')
+        if mt in ADD_TYPES or mt == b'U':
+            self.add(d['Order Book ID'], d['Side'], d['Order ID'],
+                     d['Price'], d['Quantity'])
+        elif mt in (b'E', b'C'):
+            self.execute(d['Order Book ID'], d['Side'], d['Order ID'],
+                         d['Executed Quantity'])
+        elif mt == b'D':
+            self.delete(d['Order Book ID'], d['Side'], d['Order ID'])
+        elif d.get('Message Types') == b'O':
+            self.states[d['Order Book ID']] = d['State Name'].rstrip(b' ')
+
+    def live(self):
+        '''
+            slots holding an order
+        '''
+        return np.flatnonzero(self.quantity[:self.used])
+
+    def levels(self, book, side, depth=None):
+        '''
+            (price, quantity, order count) per price level, best first
+        '''
+        slots = self.live()
+        slots = slots[(self.book[slots] == book) &
+                      (self.side[slots] == SIDES[side])]
+        prices, index, counts = np.unique(
+            self.price[slots], return_inverse=True, return_counts=True)
+        quantities = np.bincount(index, weights=self.quantity[slots],
+                                 minlength=len(prices)).astype(np.uint64)
+        if side == b'B':
+            prices, quantities, counts = \
+                prices[::-1], quantities[::-1], counts[::-1]
+        return list(zip(prices.tolist(), quantities.tolist(),
+                        counts.tolist()))[:depth]
+
+    def books(self):
+        return np.unique(self.book[self.live()])
+
+    def orders(self):
+        '''
+            copy of the live orders (ORDER_DTYPE) in queue priority order
+        '''
+        slots = self.live()
+        slots = slots[np.argsort(self.priority[slots], kind='stable')]
+        orders = np.empty(len(slots), dtype=ORDER_DTYPE)
+        for name in self.COLUMNS:
+            orders[name] = getattr(self, name)[slots]
+        return orders
+
+    @classmethod
+    def from_orders(cls, orders, states=None):
+        '''
+            book holding orders (ORDER_DTYPE, e.g. from orders())
+        '''
+        book = cls(max(len(orders), 1))
+        for name in cls.COLUMNS:
+            getattr(book, name)[:len(orders)] = orders[name]
+        book.used = len(orders)
+        book.slots = dict(zip(
+            zip(orders['book'].tolist(), orders['side'].tolist(),
+                orders['order_id'].tolist()), range(len(orders))))
+        if len(orders):
+            book.next_priority = int(orders['priority'].max()) + 1
+        book.states = dict(states or {})
+        return book
@@ -0,0 +1,75 @@
+import argparse
+import heapq
+import pcap_index
+import pcap_mold_extract
+from data_messages import NS
+
+
+def soup_stream(pcap_file, src_addr=None):
+    '''
+        (absolute time, message) for the sequenced messages of a
+        SoupBinTCP capture (from src_addr)
+    '''
+    return ((d['Timestamp'], d) for _, _, _, d in pcap_index.iter_from(
+        pcap_file, pcap_index.first_entry(), 'tcp', src_addr))
+
+
+def mold_stream(pcap_file, groups=None, port=None):
+    '''
+        (absolute time, message) for the messages of a MoldUDP64 capture,
+        duplicates dropped
+    '''
+    return ((d['Timestamp'], d) for _, _, d in pcap_mold_extract.iter_msgs(
+        pcap_file, groups, port))
+
+
+def merge(streams):
+    '''
+        k-way merge of per partition (time, message) streams, each in time
+        order, into (time, partition, message) in global time order; one
+        message per partition is held at a time
+    '''
+    heap = []
+    for i, stream in enumerate(streams):
+        it = iter(stream)
+        for ts, d in it:
+            heap.append((ts, i, d, it))
+            break
+    heapq.heapify(heap)
+    while heap:
+        ts, i, d, it = heap[0]
+        yield ts, i, d
+        for ts, d in it:
+            heapq.heapreplace(heap, (ts, i, d, it))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+def parse_addr(spec):
+    '''
+        'pcap_file' or 'pcap_file@ip:port' (source address of the flow)
+    '''
+    pcap_file, _, addr = spec.partition('@')
+    if not addr:
+        return pcap_file, None
+    ip, port = addr.rsplit(':', 1)
+    return pcap_file, (ip, int(port))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tcp-pcaps', default=[], nargs='*',
+                        help='SoupBinTCP partitions, as pcap_file or '
+                        'pcap_file@src_ip:src_port')
+    parser.add_argument('--udp-pcaps', default=[], nargs='*',
+                        help='MoldUDP64 partitions')
+    parser.add_argument('--port', type=int, default=None,
+                        help='UDP port of the MoldUDP64 partitions')
+    args = parser.parse_args()
+
+    streams = [soup_stream(*parse_addr(spec)) for spec in args.tcp_pcaps]
+    streams += [mold_stream(pcap_file, port=args.port)
+                for pcap_file in args.udp_pcaps]
+    for ts, partition, d in merge(streams):
+        print(f'{ts // NS}.{ts % NS:09d} {partition}: {d}')
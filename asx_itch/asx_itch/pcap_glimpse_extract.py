@@ -1,6 +1,7 @@
 import scapy.all as sa
 import scapy
 import itch_SoupBinTCP_decode
+import data_messages
 from pprint import pprint
 from collections import defaultdict
 import argparse
@@ -11,10 +12,15 @@ pkt_types_in = {b'S', b'+', b'A', b'J', b'H', b'Z'}
 def iter_msgs(pcap_file='./tcp_partition4.pcap',
               dst_addr=('10.31.38.4', 45793),
               src_addr=('203.0.119.230', 21804),
-              debug=False):
+              debug=False, errors=None):
+    '''
+        with errors (data_messages.DecodeErrors), bad messages are counted
+        and skipped instead of raising
+    '''
     pcap = sa.rdpcap(pcap_file)
 
-    remain = b''
+    decoders = defaultdict(
+        lambda: itch_SoupBinTCP_decode.StreamDecoder(errors))
     for pkt in pcap:
         if not (sa.TCP in pkt and sa.Raw in pkt and sa.IP in pkt):
             if debug:
@@ -26,27 +32,72 @@ def iter_msgs(pcap_file='./tcp_partition4.pcap',
         ip_src = pkt[sa.IP].src
         ip_dst = pkt[sa.IP].dst
         raw = bytes(pkt[sa.Raw])
-        if ip_src == src_addr[0]:
-            raw = remain + raw
-            if debug and remain:
-                print('remain = ', remain)
-            if debug and raw[2:3] not in pkt_types_in:
-                print('not a proper message type: ',
-                      raw[2:3], 'raw_len', len(raw), 'raw', raw)
-                continue
+        if errors is not None:
+            errors.context = pkt.time
+        decoder = decoders[
+            ip_src, pkt[sa.TCP].sport, ip_dst, pkt[sa.TCP].dport]
+        if debug and len(decoder):
+            print('remain = ', decoder.pending())
+        if debug and not len(decoder) and raw[2:3] not in pkt_types_in:
+            print('not a proper message type: ',
+                  raw[2:3], 'raw_len', len(raw), 'raw', raw)
         try:
-            off = 0
-            for d, msg_len in itch_SoupBinTCP_decode.decode(raw):
-                yield d, raw[off:off+msg_len], ip_src, ip_dst
-                off += msg_len
-                assert off <= len(raw), 'unexpected: offset > len(raw)'
-            remain = raw[off:]
+            for d, raw_msg in decoder.feed(raw):
+                yield d, raw_msg, ip_src, ip_dst
         except Exception as e:
             print(e, 'error decoding payload of packet:', pkt.time)
+            decoder.reset()
         if debug:
             print('*' * 20)
 
 
+def export(directory, pcap_file='./tcp_partition4.pcap',
+           dst_addr=('10.31.38.4', 45793),
+           src_addr=('203.0.119.230', 21804),
+           fmt='npy', workers=None, intern=False):
+    '''
+        write the sequenced data messages to per message type columnar
+        files (columnar_export) instead of printing them; with intern, the
+        alphanumeric fields as codes of one table for the capture
+    '''
+    import pcap_parallel
+    import columnar_export
+    intern = data_messages.InternTable() if intern else None
+    with columnar_export.ColumnarWriter(directory, fmt,
+                                        intern=intern) as writer:
+        for batch in pcap_parallel.iter_batches(
+                pcap_file, dst_addr, src_addr, workers):
+            writer.write(batch)
+
+
+def iter_batch_msgs(batches, ip_src, ip_dst):
+    '''
+        the rows of columnar.Batch objects in capture order, as iter_msgs
+        yields the sequenced data messages: (packet dict with the message
+        dict under 'decode', None, ip_src, ip_dst); the message dicts are
+        zipped from the row values, not decoded again
+    '''
+    second = 0
+    for batch in batches:
+        stamps, second = batch.timestamps(second)
+        rows = {mt: table.tolist() for mt, table in batch.tables.items()}
+        stamps = {mt: stamps[mt].tolist() for mt in rows}
+        pos = dict.fromkeys(rows, 0)
+        types = batch.types
+        for i in range(len(types)):
+            mt = types[i:i + 1]
+            msg_cls = data_messages.MSG_TYPE_STRUCT_MAP[mt]
+            k = pos[mt]
+            pos[mt] += 1
+            d = dict(zip(batch.tables[mt].dtype.names, rows[mt][k]))
+            for f, xform in getattr(msg_cls, 'POST_PROCESSING', {}).items():
+                if f in d:
+                    d[f] = xform(d[f])
+            d['Timestamp'] = stamps[mt][k]
+            yield ({'Message Type:': b'S', 'len': msg_cls.STRUCT.size + 1,
+                    'decode': d}, None, ip_src, ip_dst)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--pcap-file', default='./tcp_partition4.pcap')
@@ -54,7 +105,25 @@ if __name__ == '__main__':
     parser.add_argument('--src-port', type=int, default=21804)
     parser.add_argument('--dst-ip', default='10.31.38.4')
     parser.add_argument('--dst-port', type=int, default=45793)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='decode with this many processes (columnar, '
+                        'sequenced data messages only)')
+    parser.add_argument('--tolerant', action='store_true',
+                        help='count and skip bad messages instead of raising')
+    parser.add_argument('--export', default=None,
+                        help='directory to write columnar files to, '
+                        'instead of printing')
+    parser.add_argument('--export-format', default='npy',
+                        choices=('npy', 'npz', 'parquet', 'varint'))
+    parser.add_argument('--intern', action='store_true',
+                        help='export alphanumeric fields as intern codes')
     args = parser.parse_args()
+    if args.tolerant and (args.export or args.workers > 1):
+        parser.error('--tolerant needs the serial decode (--workers 1, no '
+                     '--export)')
+    src_addr = (args.src_ip, args.src_port)
+    dst_addr = (args.dst_ip, args.dst_port)
+    errors = data_messages.DecodeErrors() if args.tolerant else None
 
     obid_str = 'Order Book ID'
     oid_str = 'Order ID'
@@ -63,18 +132,33 @@ if __name__ == '__main__':
     p_str = 'Price'
     s_str = 'Side'
     kws = [obid_str, obp_str, q_str, p_str, s_str, oid_str]
-    dls = defaultdict(list)
-    for d, raw_msg, ip_src, ip_dst in iter_msgs(
-            pcap_file=args.pcap_file,
-            src_addr=(args.src_ip, args.src_port),
-            dst_addr=(args.dst_ip, args.dst_port)):
-        if 'decode' not in d:
-            d['decode'] = {}
-        dd = d['decode']
-        if obp_str in dd:
-            dls[dd[obid_str]].append({k: v for k, v in dd.items() if k in kws})
-        print(f'(src, dst): ({ip_src}, {ip_dst}); decode: {d}')
-        print('-' * 20)
-    for k in dls:
-        dls[k].sort(key=lambda x: (x[s_str], x[obp_str]))
-    pprint(dls)
+    if args.export:
+        export(args.export, args.pcap_file, dst_addr=dst_addr,
+               src_addr=src_addr, fmt=args.export_format,
+               workers=args.workers, intern=args.intern)
+    else:
+        if args.workers > 1:
+            import pcap_parallel
+            msgs = iter_batch_msgs(
+                pcap_parallel.iter_batches(
+                    pcap_file=args.pcap_file, src_addr=src_addr,
+                    dst_addr=dst_addr, workers=args.workers),
+                args.src_ip, args.dst_ip)
+        else:
+            msgs = iter_msgs(pcap_file=args.pcap_file, src_addr=src_addr,
+                             dst_addr=dst_addr, errors=errors)
+        dls = defaultdict(list)
+        for d, raw_msg, ip_src, ip_dst in msgs:
+            if 'decode' not in d:
+                d['decode'] = {}
+            dd = d['decode']
+            if obp_str in dd:
+                dls[dd[obid_str]].append(
+                    {k: v for k, v in dd.items() if k in kws})
+            print(f'(src, dst): ({ip_src}, {ip_dst}); decode: {d}')
+            print('-' * 20)
+        for k in dls:
+            dls[k].sort(key=lambda x: (x[s_str], x[obp_str]))
+        pprint(dls)
+        if errors is not None:
+            errors.report()
@@ -0,0 +1,245 @@
+import argparse
+import os
+import numpy as np
+import pcap_reader
+import data_messages as dm
+import itch_MoldUDP64
+import itch_SoupBinTCP_messages as im
+from itch_SoupBinTCP_decode import StreamDecoder
+
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),      # pcap record offset of the packet
+    ('capture_ts', '<f8'),
+    ('seq', '<u8'),         # sequence number of the next message
+    ('second', '<u4'),      # last ITCH SecondsMsg before the next message
+    ('skip', '<u2')])       # payload bytes ending a frame from before
+
+PROTOS = {'tcp': pcap_reader.IP_PROTO_TCP, 'udp': pcap_reader.IP_PROTO_UDP}
+SECOND = dm.SecondsMsg.STRUCT
+MOLD_HEADER = itch_MoldUDP64.Header.STRUCT.size
+
+
+def flow_name(src_addr=None, dst_addr=None):
+    '''
+        'src-dst' of a flow filter, 'any' for an address or port of None
+    '''
+    return '-'.join('any' if addr is None else
+                    f'{addr[0]}_{"any" if addr[1] is None else addr[1]}'
+                    for addr in (src_addr, dst_addr))
+
+
+def index_path(pcap_file, proto='tcp', src_addr=None, dst_addr=None,
+               every=1000):
+    '''
+        the sidecar of an index of one flow at one entry spacing, so that
+        indexes of other flows or spacings never stand in for it
+    '''
+    return (f'{pcap_file}.{proto}.{flow_name(src_addr, dst_addr)}'
+            f'.{every}.idx.npy')
+
+
+def _iter_soup_entries(payloads, every):
+    '''
+        SoupBinTCP: frames can cross packets, so an entry is only taken at
+        the first packet (from every N) in which a frame starts
+    '''
+    rem = b''
+    seq = 1
+    second = 0
+    due = True
+    for i, (offset, ts, payload) in enumerate(payloads):
+        due = due or i % every == 0
+        buf = rem + payload if rem else payload
+        n = len(buf)
+        off = 0
+        while off + 2 <= n:
+            if due and off >= len(rem):
+                yield offset, ts, seq, second, off - len(rem)
+                due = False
+            end = off + 2 + int.from_bytes(buf[off:off + 2], 'big')
+            if end > n:
+                break
+            msg_type = buf[off + 2:off + 3]
+            if msg_type == b'S':
+                if buf[off + 3:off + 4] == b'T':
+                    second, = SECOND.unpack_from(buf, off + 3)[1:]
+                seq += 1
+            elif msg_type == b'A':
+                # login accepted carries the next sequence number
+                seq = im.SoupBinTCPMsg.decode_seq_num(buf[off + 13:end])
+            off = end
+        rem = buf[off:]
+
+
+def _iter_mold_entries(payloads, every):
+    second = 0
+    for i, (offset, ts, payload) in enumerate(payloads):
+        if len(payload) < MOLD_HEADER:
+            continue
+        _, seq, count = itch_MoldUDP64.decode_header(payload)
+        if i % every == 0:
+            yield offset, ts, seq, second, 0
+        if count == itch_MoldUDP64.END_OF_SESSION:
+            continue
+        off = MOLD_HEADER
+        for _ in range(count):
+            block_len = int.from_bytes(payload[off:off + 2], 'big')
+            if off + 2 + block_len > len(payload):
+                break
+            if payload[off + 2:off + 3] == b'T':
+                second, = SECOND.unpack_from(payload, off + 2)[1:]
+            off += 2 + block_len
+
+
+def build(pcap_file, proto='tcp', src_addr=None, dst_addr=None,
+          every=1000, index_file=None):
+    '''
+        one streaming pass over the capture, one entry every N packets of
+        the flow; saved next to the pcap unless index_file is given
+    '''
+    payloads = pcap_reader.iter_payloads(
+        pcap_file, PROTOS[proto], src_addr, dst_addr)
+    if proto == 'tcp':
+        entries = _iter_soup_entries(payloads, every)
+    else:
+        entries = _iter_mold_entries(payloads, every)
+    index = np.array(list(entries), dtype=INDEX_DTYPE)
+    np.save(index_file or index_path(pcap_file, proto, src_addr, dst_addr,
+                                     every), index)
+    return index
+
+
+def load(pcap_file, proto='tcp', index_file=None, src_addr=None,
+         dst_addr=None, every=1000):
+    '''
+        memory map the sidecar index of the flow, (re)building it when
+        missing or older than the capture
+    '''
+    index_file = index_file or index_path(pcap_file, proto, src_addr,
+                                          dst_addr, every)
+    if (not os.path.exists(index_file) or
+            os.path.getmtime(index_file) < os.path.getmtime(pcap_file)):
+        build(pcap_file, proto, src_addr, dst_addr, every, index_file)
+    return np.load(index_file, mmap_mode='r')
+
+
+def first_entry():
+    '''
+        an entry for the start of a capture, for iter_from
+    '''
+    entry = np.zeros((), dtype=INDEX_DTYPE)
+    entry['offset'] = pcap_reader.GLOBAL_HEADER_LEN
+    entry['seq'] = 1
+    return entry
+
+
+def find(index, capture_ts=None, seq=None, second=None):
+    '''
+        the last entry at or before the given capture time, sequence number
+        or ITCH second (exactly one of them)
+    '''
+    (key, value), = [(k, v) for k, v in (
+        ('capture_ts', capture_ts), ('seq', seq), ('second', second))
+        if v is not None]
+    pos = np.searchsorted(index[key], value, side='right')
+    return index[max(pos - 1, 0)]
+
+
+def iter_from(pcap_file, entry, proto='tcp', src_addr=None, dst_addr=None,
+              session=None):
+    '''
+        decode from an index entry on
+        yield (capture ts, sequence number, ITCH second, message dict) for
+        the sequenced messages, stamped by a data_messages.Clock
+        with session, MoldUDP64 packets of other sessions are skipped
+    '''
+    payloads = pcap_reader.iter_payloads(
+        pcap_file, PROTOS[proto], src_addr, dst_addr, int(entry['offset']))
+    return decode_payloads(payloads, entry, proto, session)
+
+
+def decode_payloads(payloads, entry, proto='tcp', session=None):
+    '''
+        iter_from over (_, capture ts, payload) of the flow starting at the
+        packet of entry, wherever they come from
+    '''
+    seq = int(entry['seq'])
+    clock = dm.Clock(int(entry['second']))
+    if proto == 'udp':
+        for _, ts, payload in payloads:
+            if len(payload) < MOLD_HEADER:
+                continue
+            pkt_session, first, _ = itch_MoldUDP64.decode_header(payload)
+            if session is not None and pkt_session != session:
+                continue
+            # decode() takes end of session packets as empty
+            msgs = (d for d in itch_MoldUDP64.decode(payload) if d)
+            for i, d in enumerate(msgs):
+                clock.stamp(d, pkt_session)
+                yield ts, first + i, d['Timestamp'] // dm.NS, d
+        return
+    decoder = StreamDecoder()
+    skip = int(entry['skip'])
+    for _, ts, payload in payloads:
+        if skip:
+            payload = payload[skip:]
+            skip = 0
+        for raw in decoder.feed_frames(payload):
+            if raw[2:3] == b'S' and len(raw) > 3:
+                d = clock.stamp(dm.decode_msg(raw, raw[3:4], 3))
+                yield ts, seq, d['Timestamp'] // dm.NS, d
+                seq += 1
+
+
+def iter_window(pcap_file, index, proto='tcp', src_addr=None,
+                dst_addr=None, capture_ts=None, seq=None, until=None,
+                session=None):
+    '''
+        seek by capture time or sequence number, then decode up to (not
+        including) until, in the same unit
+    '''
+    key = 0 if capture_ts is not None else 1
+    start = capture_ts if capture_ts is not None else seq
+    entry = find(index, capture_ts=capture_ts, seq=seq)
+    for rec in iter_from(pcap_file, entry, proto, src_addr, dst_addr,
+                         session):
+        if rec[key] < start:
+            continue
+        if until is not None and rec[key] >= until:
+            return
+        yield rec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./tcp_partition4.pcap')
+    parser.add_argument('--proto', choices=PROTOS, default='tcp')
+    parser.add_argument('--src-ip', default=None)
+    parser.add_argument('--src-port', type=int, default=None)
+    parser.add_argument('--dst-ip', default=None)
+    parser.add_argument('--dst-port', type=int, default=None)
+    parser.add_argument('--every', type=int, default=1000,
+                        help='index every N packets of the flow')
+    parser.add_argument('--from-ts', type=float, default=None,
+                        help='decode from this capture timestamp')
+    parser.add_argument('--from-seq', type=int, default=None,
+                        help='decode from this sequence number')
+    parser.add_argument('--until', type=float, default=None)
+    args = parser.parse_args()
+
+    src_addr = None if args.src_ip is None else (args.src_ip, args.src_port)
+    dst_addr = None if args.dst_ip is None else (args.dst_ip, args.dst_port)
+    if args.from_ts is None and args.from_seq is None:
+        index = build(args.pcap_file, args.proto, src_addr, dst_addr,
+                      args.every)
+        path = index_path(args.pcap_file, args.proto, src_addr, dst_addr,
+                          args.every)
+        print(f'{len(index)} entries in {path}')
+    else:
+        index = load(args.pcap_file, args.proto, src_addr=src_addr,
+                     dst_addr=dst_addr, every=args.every)
+        for ts, seq, second, d in iter_window(
+                args.pcap_file, index, args.proto, src_addr, dst_addr,
+                capture_ts=args.from_ts, seq=args.from_seq,
+                until=args.until):
+            print(f'{ts:.6f} {seq} {second}: {d}')
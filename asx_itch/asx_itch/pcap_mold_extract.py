@@ -0,0 +1,127 @@
+import argparse
+import socket
+from collections import defaultdict
+import pcap_reader
+import itch_MoldUDP64
+import data_messages as dm
+
+
+class SeqTracker:
+    '''
+        MoldUDP64 sequence tracking per session: gaps as (first missing,
+        last missing) and the number of messages seen more than once
+    '''
+    def __init__(self):
+        self.next_seq = {}
+        self.gaps = defaultdict(list)
+        self.duplicates = defaultdict(int)
+
+    def update(self, session, seq, count):
+        '''
+            return how many leading messages of the packet were seen already
+        '''
+        if count == itch_MoldUDP64.END_OF_SESSION:
+            count = 0
+        expected = self.next_seq.get(session)
+        if expected is None or seq == expected:
+            self.next_seq[session] = seq + count
+            return 0
+        if seq > expected:
+            self.gaps[session].append((expected, seq - 1))
+            self.next_seq[session] = seq + count
+            return 0
+        seen = min(expected - seq, count)
+        self.duplicates[session] += seen
+        self.next_seq[session] = max(expected, seq + count)
+        return seen
+
+    def report(self):
+        for session, next_seq in self.next_seq.items():
+            gaps = self.gaps.get(session, [])
+            missing = sum(last - first + 1 for first, last in gaps)
+            print(f'session {session}: next seq {next_seq}, '
+                  f'{len(gaps)} gaps ({missing} messages missing), '
+                  f'{self.duplicates.get(session, 0)} duplicates')
+            for first, last in gaps:
+                print(f'    gap {first}-{last}')
+
+
+def iter_msgs(pcap_file, groups=None, port=None, tracker=None, errors=None,
+              interns=None, projection=None):
+    '''
+        yield (capture ts, header dict, message dict) for the MoldUDP64
+        messages sent to any of groups (all if None) on port (any if None),
+        skipping the ones seen already on the same session; messages carry
+        their absolute time as 'Timestamp' (data_messages.Clock)
+        with errors (data_messages.DecodeErrors), bad blocks are counted and
+        skipped instead of raising
+        with interns (a dict, filled as sessions show up with their
+        data_messages.InternTable), alphanumeric fields come as codes
+        with projection (data_messages.compile_projection), only the fields
+        kept are decoded
+    '''
+    groups = None if groups is None else {
+        socket.inet_aton(group) for group in groups}
+    tracker = SeqTracker() if tracker is None else tracker
+    clock = dm.Clock()
+    for _, ts, frame in pcap_reader.iter_packets(pcap_file):
+        ip = pcap_reader.decode_ip(frame)
+        if ip is None or ip[0] != pcap_reader.IP_PROTO_UDP:
+            continue
+        _, _, _, ip_dst, dport, raw = ip
+        if (groups is not None and ip_dst not in groups or
+                port not in (None, dport) or
+                len(raw) < itch_MoldUDP64.Header.STRUCT.size):
+            continue
+        if errors is not None:
+            errors.context = ts
+        session, seq, count = itch_MoldUDP64.decode_header(raw)
+        intern = None
+        if interns is not None:
+            intern = interns.get(session)
+            if intern is None:
+                intern = interns[session] = dm.InternTable()
+        header = dict(zip(itch_MoldUDP64.Header.FIELDS,
+                          (session, seq, count)))
+        # the blocks seen already are stepped over by position, not
+        # decoded, so a bad block dropped in tolerant mode cannot shift the
+        # ones kept
+        seen = tracker.update(session, seq, count)
+        for d in itch_MoldUDP64.decode(raw, errors=errors, clock=clock,
+                                       intern=intern, projection=projection,
+                                       skip=seen):
+            if d:
+                yield ts, header, d
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./udp_partition4.pcap')
+    parser.add_argument('--mcast-groups', default=None, nargs='*',
+                        help='multicast groups to extract; all if unspecified')
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--tolerant', action='store_true',
+                        help='count and skip bad blocks instead of raising')
+    parser.add_argument('--intern', action='store_true',
+                        help='print alphanumeric fields as intern codes')
+    parser.add_argument('--project', default=[], nargs='+', action='append',
+                        metavar=('MSG_TYPE', 'FIELD'),
+                        help='decode only these fields of a message type')
+    args = parser.parse_args()
+
+    tracker = SeqTracker()
+    errors = dm.DecodeErrors() if args.tolerant else None
+    interns = {} if args.intern else None
+    projection = dm.compile_projection(
+        {mt.encode(): fields for mt, *fields in args.project})
+    for ts, header, d in iter_msgs(args.pcap_file, args.mcast_groups,
+                                   args.port, tracker, errors, interns,
+                                   projection):
+        print(f'{ts:.6f} {header}: {d}')
+    tracker.report()
+    for session, intern in (interns or {}).items():
+        print(f'session {session}: {len(intern)} interned values')
+        for code, value in enumerate(intern.values):
+            print(f'    {code}: {value}')
+    if errors is not None:
+        errors.report()
@@ -0,0 +1,159 @@
+import argparse
+import bisect
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pcap_reader
+from columnar import Batch, BatchBuilder, compile_projection
+from itch_SoupBinTCP_decode import StreamDecoder
+
+# bytes of each chunk's stream kept to re-align frames crossing chunk ends
+HEAD_LEN = 1 << 16
+
+
+def decode_range(pcap_file, src_addr, dst_addr, start, end, carry=b'',
+                 projection=None):
+    '''
+        decode the flow src_addr -> dst_addr in a record aligned byte range,
+        assuming carry is the partial frame left over from before start
+        (projection: columnar.compile_projection)
+        return (batch, stream head, frame starts in the head,
+                (stream end, capture ts) of the packets in the head,
+                partial frame left over at end)
+    '''
+    builder = BatchBuilder(projection)
+    head = bytearray()
+    starts = {}
+    head_pkts = []
+    decoder = StreamDecoder()
+    decoder.feed_frames(carry)
+    # stream positions are relative to the first byte after carry
+    base = -len(carry)
+    for _, ts, payload in pcap_reader.iter_payloads(
+            pcap_file, pcap_reader.IP_PROTO_TCP, src_addr, dst_addr,
+            start, end):
+        if len(head) < HEAD_LEN:
+            head += payload[:HEAD_LEN - len(head)]
+            head_pkts.append(
+                (base + decoder.consumed + len(decoder) + len(payload), ts))
+        for raw in decoder.feed_frames(payload):
+            pos = base + decoder.consumed - len(raw)
+            if pos < HEAD_LEN:
+                starts[pos] = len(builder)
+            if len(raw) > 3 and raw[2] == 0x53:  # b'S'
+                builder.append(raw, ts, 3)
+    if base + decoder.consumed < HEAD_LEN:
+        starts[base + decoder.consumed] = len(builder)
+    return builder.build(), bytes(head), starts, head_pkts, decoder.pending()
+
+
+def realign(carry, result, projection=None):
+    '''
+        fix up a chunk decoded without knowing the partial frame (carry) in
+        front of it: re-decode the frames up to where the speculative frame
+        walk meets the real one, and drop what was decoded before that
+        return the realigned batch, or None when the walks do not meet
+    '''
+    batch, head, starts, head_pkts, _ = result
+    ends = [pkt_end for pkt_end, _ in head_pkts]
+    builder = BatchBuilder(projection)
+    decoder = StreamDecoder()
+    base = -len(carry)
+    for raw in decoder.feed_frames(carry + head):
+        pos = base + decoder.consumed - len(raw)
+        if pos in starts:
+            break
+        if len(raw) > 3 and raw[2] == 0x53:
+            pkt = bisect.bisect_left(ends, pos + len(raw))
+            builder.append(raw, head_pkts[pkt][1], 3)
+    else:
+        pos = base + decoder.consumed
+        if pos not in starts:
+            return None
+    return Batch.concat([builder.build(), batch.drop_head(starts[pos])])
+
+
+def iter_batches(pcap_file='./tcp_partition4.pcap',
+                 dst_addr=('10.31.38.4', 45793),
+                 src_addr=('203.0.119.230', 21804),
+                 workers=None, chunks=None, fields=None):
+    '''
+        decode a SoupBinTCP flow with a pool of worker processes
+        yield one Batch per chunk of the file, in capture order
+        with fields ({message type: fields to keep}), the tables of those
+        types hold only these (columnar.compile_projection)
+    '''
+    workers = workers or os.cpu_count()
+    projection = compile_projection(fields) if fields else None
+    ranges = pcap_reader.split_ranges(pcap_file, chunks or workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def submit(start, end, carry=b''):
+            return pool.submit(decode_range, pcap_file, src_addr, dst_addr,
+                               start, end, carry, projection)
+        window = 2 * workers
+        futures = [submit(*r) for r in ranges[:window]]
+        carry = b''
+        for i, (start, end) in enumerate(ranges):
+            if i + window < len(ranges):
+                futures.append(submit(*ranges[i + window]))
+            result = futures[i].result()
+            futures[i] = None
+            batch = realign(carry, result, projection) \
+                if carry else result[0]
+            if batch is None:
+                # the frame walks never met, redo the chunk the slow way
+                result = submit(start, end, carry).result()
+                batch = result[0]
+            carry = result[-1]
+            yield batch
+
+
+def iter_dicts(pcap_file='./tcp_partition4.pcap',
+               dst_addr=('10.31.38.4', 45793),
+               src_addr=('203.0.119.230', 21804),
+               workers=None, chunks=None, fields=None):
+    '''
+        the messages of iter_batches as dicts, with their absolute time
+        carried across batches
+    '''
+    second = 0
+    for batch in iter_batches(pcap_file, dst_addr, src_addr, workers,
+                              chunks, fields):
+        yield from batch.iter_dicts(second)
+        _, second = batch.timestamps(second)
+
+
+def extract(pcap_file='./tcp_partition4.pcap',
+            dst_addr=('10.31.38.4', 45793),
+            src_addr=('203.0.119.230', 21804),
+            workers=None, chunks=None, fields=None):
+    return Batch.concat(
+        iter_batches(pcap_file, dst_addr, src_addr, workers, chunks, fields))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./tcp_partition4.pcap')
+    parser.add_argument('--src-ip', default='203.0.119.230')
+    parser.add_argument('--src-port', type=int, default=21804)
+    parser.add_argument('--dst-ip', default='10.31.38.4')
+    parser.add_argument('--dst-port', type=int, default=45793)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunks', type=int, default=None)
+    parser.add_argument('--project', default=[], nargs='+', action='append',
+                        metavar=('MSG_TYPE', 'FIELD'),
+                        help='decode only these fields of a message type')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    batch = extract(args.pcap_file,
+                    src_addr=(args.src_ip, args.src_port),
+                    dst_addr=(args.dst_ip, args.dst_port),
+                    workers=args.workers, chunks=args.chunks,
+                    fields={mt.encode(): fields
+                            for mt, *fields in args.project})
+    elapsed = time.perf_counter() - t0
+    for mt, table in sorted(batch.tables.items()):
+        print(mt, len(table))
+    print(f'{len(batch)} messages in {elapsed:.3f}s, '
+          f'{len(batch) / max(elapsed, 1e-9):.0f} msgs/s')
@@ -0,0 +1,325 @@
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import pcap_index
+import pcap_reader
+import data_messages as dm
+import itch_MoldUDP64
+from columnar import DTYPES, Batch, gather
+from itch_SoupBinTCP_decode import StreamDecoder
+
+# per message type byte: message size, Order Book ID offset (-1 if none),
+# whether Timestamp Nanoseconds follows the type
+ITEMSIZE = np.zeros(256, dtype=np.int64)
+BOOK_OFFSET = np.full(256, -1, dtype=np.int64)
+HAS_NS = np.zeros(256, dtype=bool)
+for _mt, _dtype in DTYPES.items():
+    ITEMSIZE[_mt[0]] = _dtype.itemsize
+    if 'Order Book ID' in _dtype.names:
+        BOOK_OFFSET[_mt[0]] = _dtype.fields['Order Book ID'][1]
+    HAS_NS[_mt[0]] = 'Timestamp Nanoseconds' in _dtype.names
+T = ord(dm.SecondsMsg.MT)
+DAY = 86400
+
+
+def be(buf, pos, width=4):
+    '''
+        big endian unsigned ints of width (2, 4 or 8) bytes at each of pos
+        in buf (a uint8 array)
+    '''
+    rows = buf[np.asarray(pos)[:, None] + np.arange(width)]
+    return rows.view(f'>u{width}').reshape(-1).astype(np.int64)
+
+
+class Chunk:
+    '''
+        a run of raw messages out of a capture: the payload bytes (and as a
+        uint8 array), offsets of the messages (at their type), their sizes,
+        capture timestamps and sequence numbers, and the MoldUDP64 session
+        of each (None for SoupBinTCP)
+    '''
+    def __init__(self, data, offsets, sizes, capture_ts, seqs,
+                 sessions=None):
+        self.data = data
+        self.buf = np.frombuffer(data, dtype=np.uint8)
+        self.offsets = offsets
+        self.sizes = sizes
+        self.capture_ts = capture_ts
+        self.seqs = seqs
+        self.sessions = sessions
+        self.types = self.buf[offsets]
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+def _soup_chunk(decoder, data, ends, stamps, seq):
+    pending = len(decoder)
+    raw, starts = decoder.feed_block(b''.join(data))
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    lens = buf[starts].astype(np.int64) << 8 | buf[starts + 1]
+    sequenced = lens > 1
+    sequenced[sequenced] = buf[starts[sequenced] + 2] == ord('S')
+    starts = starts[sequenced]
+    lens = lens[sequenced]
+    # a frame was captured with the packet its last byte came in
+    pkt = np.searchsorted(ends, starts + 2 + lens - pending)
+    seqs = seq + np.arange(len(starts), dtype=np.int64)
+    return Chunk(raw, starts + 3, lens - 1,
+                 np.asarray(stamps)[pkt], seqs), seq + len(starts)
+
+
+def iter_soup_chunks(payloads, entry, chunk_size):
+    decoder = StreamDecoder()
+    skip = int(entry['skip'])
+    seq = int(entry['seq'])
+    data, ends, stamps = [], [], []
+    size = 0
+    for _, ts, payload in payloads:
+        if skip:
+            payload = payload[skip:]
+            skip = 0
+        data.append(payload)
+        size += len(payload)
+        ends.append(size)
+        stamps.append(ts)
+        if size >= chunk_size:
+            chunk, seq = _soup_chunk(decoder, data, ends, stamps, seq)
+            yield chunk
+            data, ends, stamps = [], [], []
+            size = 0
+    if data:
+        yield _soup_chunk(decoder, data, ends, stamps, seq)[0]
+
+
+def _mold_chunk(data, offsets, sizes, stamps, seqs, sessions):
+    return Chunk(b''.join(data), np.array(offsets, dtype=np.int64),
+                 np.array(sizes), np.array(stamps), np.array(seqs),
+                 np.array(sessions, dtype='S10'))
+
+
+def iter_mold_chunks(payloads, chunk_size):
+    data, offsets, sizes, stamps, seqs, sessions = [], [], [], [], [], []
+    size = 0
+    for _, ts, payload in payloads:
+        if len(payload) < itch_MoldUDP64.Header.STRUCT.size:
+            continue
+        session, seq, count = itch_MoldUDP64.decode_header(payload)
+        if count == itch_MoldUDP64.END_OF_SESSION:
+            continue
+        for i, (offset, block_len) in enumerate(
+                itch_MoldUDP64.iter_msg_offsets(payload)):
+            if offset + block_len > len(payload):
+                break
+            if not block_len:
+                continue
+            offsets.append(size + offset)
+            sizes.append(block_len)
+            stamps.append(ts)
+            seqs.append(seq + i)
+            sessions.append(session)
+        data.append(payload)
+        size += len(payload)
+        if size >= chunk_size:
+            yield _mold_chunk(data, offsets, sizes, stamps, seqs, sessions)
+            data, offsets, sizes, stamps, seqs, sessions = (
+                [], [], [], [], [], [])
+            size = 0
+    if data:
+        yield _mold_chunk(data, offsets, sizes, stamps, seqs, sessions)
+
+
+class Query:
+    '''
+        message filter run over the raw messages of a chunk, with numpy,
+        before anything is decoded: message types, Order Book IDs, and
+        absolute time (epoch ns, as data_messages.Clock) in [start, end)
+    '''
+    def __init__(self, types=None, books=None, start=None, end=None):
+        self.types = None
+        if types:
+            self.types = np.zeros(256, dtype=bool)
+            self.types[[mt[0] for mt in types]] = True
+        self.books = None if not books else np.unique(books)
+        self.start = start
+        self.end = end
+
+    def select(self, chunk, second=0):
+        '''
+            return (selected mask, absolute times, mask of the SecondsMsg
+            in force for a time in the range, second in force after)
+        '''
+        buf = chunk.buf
+        mts = chunk.types
+        # messages too short for their type are never selected
+        valid = (chunk.sizes >= ITEMSIZE[mts]) & (ITEMSIZE[mts] > 0)
+        is_t = valid & (mts == T)
+        seconds = np.concatenate(
+            [[second], be(buf, chunk.offsets[is_t] + 1)])
+        seconds = seconds[np.cumsum(is_t)]
+        ns_pos = np.where(valid & HAS_NS[mts], chunk.offsets + 1, 0)
+        stamps = seconds * dm.NS + np.where(
+            valid & HAS_NS[mts], be(buf, ns_pos), 0)
+        selected = valid.copy()
+        if self.types is not None:
+            selected &= self.types[mts]
+        if self.books is not None:
+            book_offset = BOOK_OFFSET[mts]
+            has_book = valid & (book_offset >= 0)
+            books = be(buf, np.where(has_book,
+                                     chunk.offsets + book_offset, 0))
+            selected &= has_book & np.isin(books, self.books)
+        in_force = is_t.copy()
+        if self.start is not None:
+            selected &= stamps >= self.start
+            in_force &= (seconds + 1) * dm.NS > self.start
+        if self.end is not None:
+            selected &= stamps < self.end
+            in_force &= stamps < self.end
+        if len(seconds):
+            second = int(seconds[-1])
+        return selected, stamps, in_force, second
+
+    def done(self, stamps):
+        return self.end is not None and len(stamps) and stamps[-1] >= self.end
+
+
+def search(pcap_file, query, proto='tcp', src_addr=None, dst_addr=None,
+           chunk_size=1 << 22):
+    '''
+        seek with the capture's index (pcap_index, built if missing) to the
+        start of the query, then scan chunk_size bytes of payload at a time
+        until its end
+        yield (chunk, selected mask, absolute times, SecondsMsg in force
+               mask, second in force before the chunk)
+    '''
+    index = pcap_index.load(pcap_file, proto, src_addr=src_addr,
+                            dst_addr=dst_addr)
+    if query.start is not None and len(index):
+        # the last entry before any message of the start second
+        entry = pcap_index.find(index, second=query.start // dm.NS - 1)
+    else:
+        entry = pcap_index.first_entry()
+    payloads = pcap_reader.iter_payloads(
+        pcap_file, pcap_index.PROTOS[proto], src_addr, dst_addr,
+        int(entry['offset']))
+    if proto == 'tcp':
+        chunks = iter_soup_chunks(payloads, entry, chunk_size)
+    else:
+        chunks = iter_mold_chunks(payloads, chunk_size)
+    second = int(entry['second'])
+    for chunk in chunks:
+        before = second
+        selected, stamps, in_force, second = query.select(chunk, second)
+        yield chunk, selected, stamps, in_force, before
+        if query.done(stamps):
+            return
+
+
+def iter_msgs(results):
+    '''
+        (capture ts, sequence number, message dict) of the selected
+        messages of search(), decoded and stamped
+    '''
+    for chunk, selected, stamps, _, _ in results:
+        for i in np.flatnonzero(selected).tolist():
+            offset = int(chunk.offsets[i])
+            d = dm.decode_msg(chunk.data, chunk.data[offset:offset + 1],
+                              offset)
+            d['Timestamp'] = int(stamps[i])
+            yield float(chunk.capture_ts[i]), int(chunk.seqs[i]), d
+
+
+def to_batch(chunk, selected, in_force):
+    '''
+        columnar.Batch of the selected messages, with the SecondsMsg their
+        times depend on
+    '''
+    keep = np.flatnonzero(selected | in_force)
+    mts = chunk.types[keep]
+    tables = {}
+    capture_ts = {}
+    for code in np.unique(mts).tolist():
+        mt = bytes([code])
+        rows = keep[mts == code]
+        tables[mt] = gather(chunk.buf, chunk.offsets[rows], mt)
+        capture_ts[mt] = chunk.capture_ts[rows].astype(np.float64)
+    return Batch(mts.tobytes(), tables, capture_ts)
+
+
+def parse_time(text, day=0):
+    '''
+        epoch ns of 'HH:MM[:SS[.f]]' on day (epoch second of its midnight),
+        or of a plain number of seconds
+    '''
+    if ':' not in text:
+        return round(float(text) * dm.NS)
+    parts = text.split(':')
+    seconds = int(parts[0]) * 3600 + int(parts[1]) * 60
+    if len(parts) > 2:
+        seconds += float(parts[2])
+    return day * dm.NS + round(seconds * dm.NS)
+
+
+def jsonable(d):
+    return {k: v.decode('latin-1').rstrip() if isinstance(v, bytes) else v
+            for k, v in d.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./tcp_partition4.pcap')
+    parser.add_argument('--proto', choices=pcap_index.PROTOS, default='tcp')
+    parser.add_argument('--src-ip', default=None)
+    parser.add_argument('--src-port', type=int, default=None)
+    parser.add_argument('--dst-ip', default=None)
+    parser.add_argument('--dst-port', type=int, default=None)
+    parser.add_argument('--from', dest='start', default=None,
+                        help='HH:MM[:SS[.f]] (on the capture day, UTC for '
+                        'epoch seconds) or seconds')
+    parser.add_argument('--to', dest='end', default=None)
+    parser.add_argument('--types', default=None, nargs='*',
+                        help='message types, e.g. E C P')
+    parser.add_argument('--books', default=None, nargs='*', type=int,
+                        help='Order Book IDs')
+    parser.add_argument('--format', default='text',
+                        choices=('text', 'jsonl', 'npy', 'npz', 'parquet',
+                                 'varint'))
+    parser.add_argument('--out', default=None,
+                        help='directory of a columnar output')
+    parser.add_argument('--chunk-size', type=int, default=1 << 22)
+    args = parser.parse_args()
+
+    src_addr = None if args.src_ip is None else (args.src_ip, args.src_port)
+    dst_addr = None if args.dst_ip is None else (args.dst_ip, args.dst_port)
+    index = pcap_index.load(args.pcap_file, args.proto, src_addr=src_addr,
+                            dst_addr=dst_addr)
+    day = int(index['second'][-1]) // DAY * DAY if len(index) else 0
+    query = Query(
+        [mt.encode() for mt in args.types or ()], args.books,
+        None if args.start is None else parse_time(args.start, day),
+        None if args.end is None else parse_time(args.end, day))
+    t0 = time.perf_counter()
+    results = search(args.pcap_file, query, args.proto, src_addr, dst_addr,
+                     args.chunk_size)
+    count = 0
+    if args.format in ('text', 'jsonl'):
+        for ts, seq, d in iter_msgs(results):
+            if args.format == 'text':
+                print(f'{ts:.6f} {seq}: {d}')
+            else:
+                print(json.dumps(dict(jsonable(d), **{
+                    'Capture Timestamp': ts, 'Sequence Number': seq})))
+            count += 1
+    else:
+        import columnar_export
+        with columnar_export.ColumnarWriter(args.out or './query',
+                                            args.format) as writer:
+            for chunk, selected, _, in_force, second in results:
+                writer.second = second
+                writer.write(to_batch(chunk, selected, in_force))
+                count += int(selected.sum())
+    print(f'{count} messages in {time.perf_counter() - t0:.3f}s',
+          file=sys.stderr)
@@ -0,0 +1,188 @@
+import os
+import socket
+import struct
+
+# classic libpcap only (no pcapng); magic read as little endian
+MAGIC_USEC = 0xa1b2c3d4
+MAGIC_NSEC = 0xa1b23c4d
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+LINKTYPE_ETHERNET = 1
+
+ETH_HEADER_LEN = 14
+ETH_TYPE = struct.Struct('!H')
+ETH_TYPE_IPV4 = 0x0800
+ETH_TYPE_VLAN = (0x8100, 0x88a8)
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+PORTS = struct.Struct('!HH')
+
+
+class PcapFormat:
+    '''
+        byte order, timestamp resolution and link type of a pcap file
+    '''
+    def __init__(self, raw):
+        magic, = struct.unpack_from('<I', raw)
+        if magic in (MAGIC_USEC, MAGIC_NSEC):
+            endian = '<'
+        else:
+            magic, = struct.unpack_from('>I', raw)
+            if magic not in (MAGIC_USEC, MAGIC_NSEC):
+                raise ValueError(f'not a pcap file, magic={raw[:4]}')
+            endian = '>'
+        self.ts_scale = 1e-9 if magic == MAGIC_NSEC else 1e-6
+        self.record = struct.Struct(endian + 'IIII')
+        _, _, _, _, self.snaplen, self.linktype = struct.unpack_from(
+            endian + 'HHiIII', raw, 4)
+        if self.linktype != LINKTYPE_ETHERNET:
+            raise ValueError(f'unsupported link type {self.linktype}')
+
+    def plausible(self, raw, offset, sec_lo, sec_hi):
+        '''
+            whether a record header starts at offset in raw, given the
+            range its capture seconds should be in
+        '''
+        sec, frac, incl_len, orig_len = self.record.unpack_from(raw, offset)
+        return (sec_lo <= sec <= sec_hi
+                and ETH_HEADER_LEN <= incl_len <= orig_len
+                and incl_len <= self.snaplen
+                and frac < 1 / self.ts_scale)
+
+
+def read_format(pcap_file):
+    with open(pcap_file, 'rb') as f:
+        return PcapFormat(f.read(GLOBAL_HEADER_LEN))
+
+
+def iter_packets(pcap_file, start=None, end=None, buffer_size=1 << 20):
+    '''
+        yield (file offset, capture timestamp, frame bytes) for every record
+        whose header starts in [start, end); start must be record aligned
+    '''
+    with open(pcap_file, 'rb', buffering=buffer_size) as f:
+        fmt = PcapFormat(f.read(GLOBAL_HEADER_LEN))
+        record = fmt.record
+        ts_scale = fmt.ts_scale
+        offset = GLOBAL_HEADER_LEN if start is None else start
+        f.seek(offset)
+        end = os.fstat(f.fileno()).st_size if end is None else end
+        while offset < end:
+            head = f.read(RECORD_HEADER_LEN)
+            if len(head) < RECORD_HEADER_LEN:
+                return
+            sec, frac, incl_len, _ = record.unpack(head)
+            frame = f.read(incl_len)
+            if len(frame) < incl_len:
+                return
+            yield offset, sec + frac * ts_scale, frame
+            offset += RECORD_HEADER_LEN + incl_len
+
+
+def decode_ip(frame):
+    '''
+        decode Ethernet / IPv4 / TCP or UDP headers
+        return (ip proto, src ip, src port, dst ip, dst port, payload) with
+        packed 4 byte addresses, or None for anything else
+    '''
+    offset = ETH_HEADER_LEN
+    eth_type, = ETH_TYPE.unpack_from(frame, 12)
+    while eth_type in ETH_TYPE_VLAN:
+        eth_type, = ETH_TYPE.unpack_from(frame, offset + 2)
+        offset += 4
+    if eth_type != ETH_TYPE_IPV4 or len(frame) < offset + 20:
+        return None
+    ihl = (frame[offset] & 0x0f) * 4
+    ip_len, = ETH_TYPE.unpack_from(frame, offset + 2)
+    proto = frame[offset + 9]
+    ip_src = frame[offset + 12:offset + 16]
+    ip_dst = frame[offset + 16:offset + 20]
+    ip_end = offset + ip_len
+    offset += ihl
+    if proto == IP_PROTO_TCP:
+        sport, dport = PORTS.unpack_from(frame, offset)
+        payload = frame[offset + (frame[offset + 12] >> 4) * 4:ip_end]
+    elif proto == IP_PROTO_UDP:
+        sport, dport = PORTS.unpack_from(frame, offset)
+        payload = frame[offset + 8:ip_end]
+    else:
+        return None
+    return proto, ip_src, sport, ip_dst, dport, payload
+
+
+def pack_addr(addr):
+    '''
+        (ip str, port) -> (packed ip, port), as compared against decode_ip
+    '''
+    return socket.inet_aton(addr[0]), addr[1]
+
+
+def iter_payloads(pcap_file, proto, src_addr=None, dst_addr=None,
+                  start=None, end=None):
+    '''
+        yield (file offset, capture timestamp, payload) of the non empty
+        packets of proto from src_addr to dst_addr (either may be None,
+        and a port of None matches any port)
+    '''
+    src_ip, src_port = (None, None) if src_addr is None else \
+        pack_addr(src_addr)
+    dst_ip, dst_port = (None, None) if dst_addr is None else \
+        pack_addr(dst_addr)
+    for offset, ts, frame in iter_packets(pcap_file, start, end):
+        ip = decode_ip(frame)
+        if ip is None or ip[0] != proto or not ip[5]:
+            continue
+        _, ip_src, sport, ip_dst, dport, payload = ip
+        if src_ip is not None and (ip_src != src_ip or
+                                   src_port not in (None, sport)):
+            continue
+        if dst_ip is not None and (ip_dst != dst_ip or
+                                   dst_port not in (None, dport)):
+            continue
+        yield offset, ts, payload
+
+
+def split_ranges(pcap_file, n_chunks, probe=8, max_gap=3600):
+    '''
+        split a pcap file into at most n_chunks record aligned byte ranges
+        return [(start, end)]
+    '''
+    size = os.path.getsize(pcap_file)
+    starts = [GLOBAL_HEADER_LEN]
+    with open(pcap_file, 'rb') as f:
+        fmt = PcapFormat(f.read(GLOBAL_HEADER_LEN))
+        first = f.read(RECORD_HEADER_LEN)
+        if len(first) < RECORD_HEADER_LEN:
+            return [(GLOBAL_HEADER_LEN, size)]
+        sec_lo = fmt.record.unpack(first)[0]
+        window = probe * (RECORD_HEADER_LEN + fmt.snaplen)
+        for i in range(1, n_chunks):
+            target = max(GLOBAL_HEADER_LEN + i * size // n_chunks, starts[-1])
+            f.seek(target)
+            offset = _resync(fmt, f.read(window), probe, sec_lo, max_gap)
+            if offset is not None and target + offset > starts[-1]:
+                starts.append(target + offset)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _resync(fmt, raw, probe, sec_lo, max_gap):
+    '''
+        first offset in raw from which probe record headers chain up with
+        non decreasing (within max_gap) capture seconds
+    '''
+    for offset in range(len(raw) - RECORD_HEADER_LEN):
+        pos = offset
+        lo, hi = sec_lo, 0xffffffff
+        for _ in range(probe):
+            if pos + RECORD_HEADER_LEN > len(raw):
+                break
+            if not fmt.plausible(raw, pos, lo, hi):
+                break
+            sec, _, incl_len, _ = fmt.record.unpack_from(raw, pos)
+            lo, hi = sec, sec + max_gap
+            pos += RECORD_HEADER_LEN + incl_len
+        else:
+            return offset
+        if pos + RECORD_HEADER_LEN > len(raw) and pos != offset:
+            return offset
+    return None
@@ -0,0 +1,128 @@
+import argparse
+import os
+import numpy as np
+import data_messages as dm
+from columnar import DTYPES
+
+R_DTYPE = DTYPES[dm.OrderBookDirectoryMsg.MT]
+
+
+class RefData:
+    '''
+        instrument reference data from OrderBookDirectory messages: the
+        latest R row of each Order Book ID (R_DTYPE, as received), with
+        the stripped symbols and the decimals indexed for O(1) lookups
+    '''
+    def __init__(self, table=None):
+        self.table = np.zeros(0, dtype=R_DTYPE) if table is None else table
+        self._index()
+
+    def __len__(self):
+        return len(self.table)
+
+    def _index(self):
+        # one row per book, sorted by Order Book ID for searchsorted
+        table = self.table[::-1]
+        _, first = np.unique(table['Order Book ID'], return_index=True)
+        self.table = table[first]
+        self.ids = self.table['Order Book ID']
+        self.price_decimals = self.table['Number of decimals in Price']
+        symbols = [s.rstrip(b' ').decode() for s in self.table['Symbol']]
+        books = self.ids.tolist()
+        self.rows = dict(zip(books, range(len(books))))
+        self.symbols = dict(zip(books, symbols))
+        self.books = dict(zip(symbols, books))
+        self.decimals = dict(zip(books, self.price_decimals.tolist()))
+
+    def update_table(self, table):
+        '''
+            add a columnar table of R messages; later rows win
+        '''
+        if len(table):
+            self.table = np.concatenate([self.table, table], dtype=R_DTYPE)
+            self._index()
+
+    def update(self, msgs):
+        '''
+            add the R messages among message dicts
+            (data_messages.decode_msg)
+        '''
+        self.update_table(np.array(
+            [tuple(d[f] for f in dm.OrderBookDirectoryMsg.FIELDS)
+             for d in msgs
+             if d.get('Message Type') == dm.OrderBookDirectoryMsg.MT],
+            dtype=R_DTYPE))
+
+    def symbol(self, book):
+        return self.symbols.get(book)
+
+    def book_id(self, symbol):
+        return self.books.get(symbol)
+
+    def row(self, book):
+        '''
+            the R message of book as a dict, alphanumeric fields stripped
+        '''
+        i = self.rows.get(book)
+        if i is None:
+            return None
+        row = self.table[i]
+        return {f: row[f].rstrip(b' ') if isinstance(row[f], bytes)
+                else row[f].item() for f in R_DTYPE.names}
+
+    def scale(self, books, prices):
+        '''
+            prices (any integer price column) as floats, each with the
+            decimals of its Order Book ID; nan for unknown books
+        '''
+        books = np.asarray(books)
+        if not len(self.ids):
+            return np.full(len(books), np.nan)
+        pos = np.minimum(np.searchsorted(self.ids, books), len(self.ids) - 1)
+        return np.where(self.ids[pos] == books,
+                        prices / 10.0 ** self.price_decimals[pos], np.nan)
+
+    def save(self, path):
+        tmp = f'{path}.{os.getpid()}.tmp.npy'
+        np.save(tmp, self.table)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+            the saved reference data, empty if there is none yet
+        '''
+        if not os.path.exists(path):
+            return cls()
+        return cls(np.load(path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', default='./tcp_partition4.pcap')
+    parser.add_argument('--proto', choices=('tcp', 'udp'), default='tcp')
+    parser.add_argument('--src-ip', default='203.0.119.230')
+    parser.add_argument('--src-port', type=int, default=21804)
+    parser.add_argument('--dst-ip', default='10.31.38.4')
+    parser.add_argument('--dst-port', type=int, default=45793)
+    parser.add_argument('--refdata', default='./refdata.npy',
+                        help='reference data file, updated in place')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='decode processes for a tcp capture')
+    args = parser.parse_args()
+
+    ref = RefData.load(args.refdata)
+    if args.proto == 'tcp':
+        import pcap_parallel
+        batch = pcap_parallel.extract(
+            args.pcap_file, dst_addr=(args.dst_ip, args.dst_port),
+            src_addr=(args.src_ip, args.src_port), workers=args.workers)
+        ref.update_table(batch.tables.get(dm.OrderBookDirectoryMsg.MT, []))
+    else:
+        import pcap_mold_extract
+        ref.update(d for _, _, d in pcap_mold_extract.iter_msgs(
+            args.pcap_file))
+    ref.save(args.refdata)
+    for book in ref.ids.tolist():
+        print(book, ref.symbol(book), ref.decimals[book])
+    print(f'{len(ref)} instruments in {args.refdata}')
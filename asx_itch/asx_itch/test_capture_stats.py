@@ -0,0 +1,36 @@
+from capture_stats import CaptureStats
+from pcap_query import iter_mold_chunks
+from test_pcap_query import SESSION, pkt, seconds_msg, payloads
+
+
+def stats_of(*packets, chunk_size=1 << 20):
+    stats = CaptureStats()
+    for chunk in iter_mold_chunks(payloads(*packets), chunk_size):
+        stats.update(chunk)
+    return stats
+
+
+def block(seq, n=3):
+    return pkt(seq, [seconds_msg()] * n)
+
+
+def test_retransmission_is_not_a_gap():
+    stats = stats_of(block(1), block(4), block(1), block(7))
+    assert stats.gaps == []
+    assert stats.duplicates == 3
+    assert stats.next_seq == {SESSION: 10}
+
+
+def test_gap_above_high_water_mark():
+    stats = stats_of(block(1), block(7), block(4), block(12),
+                     chunk_size=1)
+    assert stats.gaps == [(SESSION, 4, 6), (SESSION, 10, 11)]
+    # a late fill of a gap is at or below the mark
+    assert stats.duplicates == 3
+
+
+def test_sessions_kept_apart():
+    stats = stats_of(block(1), pkt(1, [seconds_msg()], b'SESSION002'),
+                     block(4))
+    assert stats.gaps == []
+    assert stats.duplicates == 0
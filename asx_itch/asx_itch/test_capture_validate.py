@@ -0,0 +1,33 @@
+import numpy as np
+from capture_validate import Report, validate_mold
+from test_pcap_query import SESSION, pkt, seconds_msg
+
+
+def validate(*packets):
+    report = Report()
+    sizes = np.array([len(p) for p in packets], dtype=np.int64)
+    validate_mold([(np.arange(len(packets)), np.cumsum(sizes) - sizes, sizes,
+                    b''.join(packets))], report)
+    return report
+
+
+def block(seq, n=3):
+    return pkt(seq, [seconds_msg()] * n)
+
+
+def test_retransmission_is_not_a_gap():
+    report = validate(block(1), block(4), block(1), block(7))
+    assert dict(report.counts) == {'seq repeat': 3}
+    assert report.regions == [('seq repeat', 2, 10, (SESSION, 1, 3))]
+
+
+def test_gap_counts_missing_messages():
+    report = validate(block(1), block(9))
+    assert dict(report.counts) == {'seq gap': 5}
+    assert report.regions == [('seq gap', 1, 10, (SESSION, 4, 8))]
+
+
+def test_zero_length_trailing_block():
+    report = validate(block(1), pkt(4, [seconds_msg(), b'']))
+    assert dict(report.counts) == {'bad length': 1}
+    assert report.messages == 4
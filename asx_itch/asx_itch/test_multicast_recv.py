@@ -0,0 +1,24 @@
+import itch_MoldUDP64
+from columnar_export import load
+from multicast_recv import record
+from test_pcap_query import pkt, seconds_msg
+
+
+class FakeSocket:
+    def __init__(self, packets):
+        self.packets = list(packets)
+
+    def recv(self, size):
+        if not self.packets:
+            raise KeyboardInterrupt
+        return self.packets.pop(0)
+
+
+def test_record_skips_bad_packets(tmp_path):
+    record(FakeSocket([
+        pkt(1, [seconds_msg()]), b'short',
+        pkt(2, [], count=itch_MoldUDP64.END_OF_SESSION),
+        pkt(2, [seconds_msg(), b'']),
+        pkt(3, [seconds_msg()])[:-2]]), str(tmp_path))
+    msgs, _ = load(str(tmp_path))['SecondsMsg']
+    assert len(msgs) == 2
@@ -0,0 +1,30 @@
+import itch_SoupBinTCP_messages as im
+from pcap_index import _iter_soup_entries
+
+
+def frame(body):
+    return len(body).to_bytes(2, 'big') + body
+
+
+def login_accepted(seq):
+    return frame(im.LoginAcceptedPktMsg.PT + b'SESSION001' +
+                 seq.rjust(20))
+
+
+def sequenced():
+    return frame(b'S' + b'T' + (1700000000).to_bytes(4, 'big'))
+
+
+def entries(*payloads):
+    return list(_iter_soup_entries(
+        [(i, float(i), p) for i, p in enumerate(payloads)], 1))
+
+
+def test_login_accepted_sets_seq():
+    assert [e[2] for e in entries(login_accepted(b'42'), sequenced(),
+                                  sequenced())] == [1, 42, 43]
+
+
+def test_blank_login_accepted_seq():
+    assert [e[2] for e in entries(login_accepted(b''), sequenced())] == [
+        1, 0]
@@ -0,0 +1,43 @@
+import struct
+import numpy as np
+import data_messages as dm
+import itch_MoldUDP64
+from capture_stats import CaptureStats
+from pcap_query import iter_mold_chunks
+
+SESSION = b'SESSION001'
+
+
+def pkt(seq, msgs, session=SESSION, count=None):
+    count = len(msgs) if count is None else count
+    return itch_MoldUDP64.Header.STRUCT.pack(session, seq, count) + b''.join(
+        itch_MoldUDP64.MSG_BLOCK.pack(len(msg)) + msg for msg in msgs)
+
+
+def seconds_msg(second=1700000000):
+    return dm.SecondsMsg.MT + struct.pack('!L', second)
+
+
+def payloads(*packets):
+    return [(0, float(i), p) for i, p in enumerate(packets)]
+
+
+def test_zero_length_trailing_block():
+    chunks = list(iter_mold_chunks(
+        payloads(pkt(1, [seconds_msg()]), pkt(2, [seconds_msg(), b''])),
+        1 << 20))
+    assert len(chunks) == 1
+    chunk = chunks[0]
+    assert chunk.types.tolist() == [ord(dm.SecondsMsg.MT)] * 2
+    assert chunk.seqs.tolist() == [1, 2]
+    stats = CaptureStats()
+    stats.update(chunk)
+    assert len(stats) == 2
+
+
+def test_short_and_end_of_session_packets():
+    chunk, = iter_mold_chunks(payloads(
+        pkt(1, [seconds_msg()]), b'short',
+        pkt(2, [], count=itch_MoldUDP64.END_OF_SESSION)), 1 << 20)
+    assert len(chunk) == 1
+    assert np.array_equal(chunk.sessions, [SESSION])